@@ -6,4 +6,6 @@ from settings import b0,b1,f1,tf
 settings = [b0,b1,f1,tf]
 
 # Call main with these settings
-main(*settings)
+# (only when run, not when imported by the live plot process)
+if __name__ == "__main__":
+    main(*settings)
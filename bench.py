@@ -0,0 +1,239 @@
+"""
+Benchmarks of the simulation parts that set the speed of a session:
+model stepping and force per grid size, drawing the arrows and the text
+panel (SDL dummy video driver, no window), GUI startup with and without the
+cached arrow atlas, reading a large tissue file and Plotter memory on long
+runs. Every benchmark is timed separately.
+
+Results are saved as JSON (name: value and unit) and compared with a stored
+baseline, so a change can be checked for being faster or slower:
+    python bench.py --save           (store the current results as baseline)
+    python bench.py                  (compare with the baseline)
+    python bench.py --quick --only model
+Exits with 1 when a result is worse than the baseline by more than the
+tolerance. Timings depend on the machine, so make the baseline on the same one.
+"""
+import os
+import gc
+import sys
+import glob
+import json
+import time
+import argparse
+import tracemalloc
+
+# No window for the GUI benchmarks, must be set before pygame starts
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+from model import Model
+from plotter import Plotter
+
+# Grid sizes for the model benchmarks
+gridsizes = [(5, 4), (64, 64), (256, 256), (1024, 1024)]
+quicksizes = [(5, 4), (64, 64)]
+
+
+def timeit(func, mintime=0.2, repeat=5):
+    '''
+    Seconds per call of func: calls it in rounds of at least mintime and
+    returns the best time per call of repeat rounds, the least disturbed
+    by other processes.
+    '''
+    # Number of calls per round from one trial call
+    t0 = time.perf_counter()
+    func()
+    ncalls = max(1, int(mintime / max(time.perf_counter() - t0, 1e-9)))
+
+    times = []
+    for k in range(repeat):
+        t0 = time.perf_counter()
+        for i in range(ncalls):
+            func()
+        times.append((time.perf_counter() - t0) / ncalls)
+    return min(times)
+
+
+def benchmodel(sizes, mintime, results):
+    '''Model.update per step and Model.force alone, for every grid size.'''
+    for m, n in sizes:
+        name = str(m) + "x" + str(n)
+        model = Model(4000, 1000, 1, m, n, seed=0)
+        model.run(0., 0.01, 10)
+
+        tsim = [0.1]
+        def step():
+            tsim[0] += 0.01
+            model.update(tsim[0], 0.01)
+        results["model.update " + name] = (timeit(step, mintime), "s")
+
+        bx, by = model.b0mag * model.b0gradient, model.b1mag * model.b1gradient
+        results["model.force " + name] = (timeit(lambda: model.force(bx, by, model.theta),
+                                                 mintime), "s")
+
+
+def benchgui(sizes, mintime, results):
+    '''
+    GUI.drawarrows and GUI.textpanel per frame, with moving arrows and
+    changing values, and GUI startup without (cold) and with (warm) the
+    cached arrow atlas in sprites.
+    '''
+    import graphics
+    caption = "MRI (Magnetic Resonance Imaging) 2D simulation"
+
+    # Cold start: no atlas and no loaded images
+    for fname in glob.glob(os.path.join("sprites", "arrowatlas-*.png")):
+        os.remove(fname)
+    graphics.imagecache.clear()
+    t0 = time.perf_counter()
+    gui = graphics.GUI(caption, 1000, 800)
+    results["gui.init cold"] = (time.perf_counter() - t0, "s")
+    del gui
+    gc.collect()
+
+    # Warm start: atlas made by the cold start, images read again
+    graphics.imagecache.clear()
+    t0 = time.perf_counter()
+    gui = graphics.GUI(caption, 1000, 800)
+    results["gui.init warm"] = (time.perf_counter() - t0, "s")
+
+    # Text panel with new values every frame, as while a key is held
+    values = [4000.]
+    def panel():
+        values[0] += 1.
+        gui.textpanel(values[0], 1000., 1., True, True)
+        gui.updatescreen()
+    results["gui.textpanel"] = (timeit(panel, mintime), "s")
+
+    # Arrows of a running model, a frame every 0.02 s
+    for m, n in sizes:
+        gui.setarrows(m, n)
+        model = Model(4000, 1000, 1, m, n, seed=0)
+        thetas = []
+        tsim = 0.
+        for k in range(50):
+            tsim = model.run(tsim, 0.01, 2)
+            thetas.append(model.theta.copy())
+        frame = [0]
+        def draw():
+            frame[0] += 1
+            gui.drawarrows(thetas[frame[0] % len(thetas)])
+            gui.updatescreen()
+        results["gui.drawarrows " + str(m) + "x" + str(n)] = (timeit(draw, mintime), "s")
+    del gui
+    gc.collect()
+
+
+def benchtissue(size, results):
+    '''
+    Model.readtissue of a large tissue text file: first read (parsing and
+    writing the cache) and later reads (from the cache).
+    '''
+    from tissue import datadir, cachedir
+    m, n = size
+    tissuefile = "benchtissue.tis"
+    filename = os.path.join(datadir, tissuefile)
+    random = np.random.RandomState(0)
+    np.savetxt(filename, random.rand(n, m), fmt="%.2f", delimiter=",")
+    try:
+        model = Model(4000, 1000, 1, m, n, seed=0)
+        name = " " + str(m) + "x" + str(n)
+        t0 = time.perf_counter()
+        model.readtissue(tissuefile)
+        results["readtissue first" + name] = (time.perf_counter() - t0, "s")
+        results["readtissue cached" + name] = (timeit(lambda: model.readtissue(tissuefile),
+                                                      0.1), "s")
+    finally:
+        os.remove(filename)
+        for fname in glob.glob(os.path.join(cachedir, tissuefile + "-*")):
+            os.remove(fname)
+
+
+def benchplotter(nsamples, results):
+    '''
+    Plotter memory after nsamples plot samples (a 300 s session has 3000),
+    for a small and a large grid, without and with a capacity.
+    '''
+    for (m, n), capacity in [((5, 4), None), ((256, 256), None), ((256, 256), 10000)]:
+        theta = np.ones((m, n)) * 180.
+        tracemalloc.start()
+        plotter = Plotter(0., 0.1, capacity=capacity)
+        for k in range(nsamples):
+            plotter.tableupdate(0.1 * (k + 1) + 0.01, 4000., theta, 1.)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del plotter
+
+        name = "plotter.memory " + str(m) + "x" + str(n)
+        if capacity is not None:
+            name += " capacity " + str(capacity)
+        results[name] = (float(current), "bytes")
+        results[name + " peak"] = (float(peak), "bytes")
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Prints every result next to its baseline value.
+    Returns the names of the results worse than the baseline by more than
+    the tolerance (a fraction, all results are lower is better).
+    '''
+    worse = []
+    print("%-44s %12s %12s %8s" % ("benchmark", "result", "baseline", "ratio"))
+    for name, (value, unit) in results.items():
+        if name in baseline and baseline[name]["value"] > 0:
+            ratio = value / baseline[name]["value"]
+            note = ""
+            if ratio > 1 + tolerance:
+                note = " slower" if unit == "s" else " more"
+                worse.append(name)
+            elif ratio < 1 / (1 + tolerance):
+                note = " faster" if unit == "s" else " less"
+            print("%-44s %12.4g %12.4g %8.2f%s" % (name, value, baseline[name]["value"],
+                                                 ratio, note))
+        else:
+            print("%-44s %12.4g %12s %8s" % (name, value, "-", "-"))
+    return worse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MRI 2D benchmarks")
+    parser.add_argument("--only", nargs="+", default=["model", "gui", "tissue", "plotter"],
+                        help="benchmark groups: model gui tissue plotter")
+    parser.add_argument("--quick", action="store_true", help="small grids and short runs")
+    parser.add_argument("--out", default="bench_output.json", help="results JSON file")
+    parser.add_argument("--baseline", default="benchbaseline.json", help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="store the results as baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed fraction worse than the baseline")
+    args = parser.parse_args()
+
+    sizes = quicksizes if args.quick else gridsizes
+    mintime = 0.05 if args.quick else 0.2
+    results = {}
+    if "model" in args.only:
+        benchmodel(sizes, mintime, results)
+    if "gui" in args.only:
+        benchgui(sizes, mintime, results)
+    if "tissue" in args.only:
+        benchtissue((256, 256) if args.quick else (1024, 1024), results)
+    if "plotter" in args.only:
+        benchplotter(3000 if args.quick else 30000, results)
+
+    # Machine readable results
+    output = {name: {"value": value, "unit": unit} for name, (value, unit) in results.items()}
+    with open(args.out, "w") as f:
+        json.dump(output, f, indent=1)
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(output, f, indent=1)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        print("No baseline " + args.baseline + ", store one with --save")
+    worse = compare(results, baseline, args.tolerance)
+    if worse:
+        print("Worse than the baseline: " + ", ".join(worse))
+        sys.exit(1)
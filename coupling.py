@@ -0,0 +1,53 @@
+"""
+Dipole-dipole coupling between the compass arrows: the magnetic field each
+arrow feels from all other arrows. Computed as a convolution of the
+magnetization (cos theta, sin theta) with the dipole kernel using FFTs on a
+zero padded grid, so O(N log N) per step instead of a loop over all pairs.
+The kernel FFTs are cached per grid shape.
+"""
+import numpy as np
+
+# FFTs of the kernel components per grid shape (m, n)
+kernelcache = {}
+
+
+def dipolekernel(m, n):
+    '''
+    FFTs of the dipole kernel components Kxx, Kxy and Kyy on the zero padded
+    (2m, 2n) grid, for a grid spacing of one. The field of a unit moment p at
+    offset r is (3 (p.r) r / r^2 - p) / r^3, no field on the arrow itself.
+    '''
+    if (m, n) not in kernelcache:
+        # Offsets 0, 1, ... and negative offsets wrapped around
+        di = np.fft.fftfreq(2 * m, 1. / (2 * m))
+        dj = np.fft.fftfreq(2 * n, 1. / (2 * n))
+
+        # y is up for the angles (as drawn), the j axis is down on the screen
+        x, y = np.meshgrid(di, -dj, indexing="ij")
+        r2 = x ** 2 + y ** 2
+        r2[0, 0] = 1.
+        r5 = r2 ** 2.5
+
+        kernels = np.array([(3 * x ** 2 - r2) / r5, 3 * x * y / r5, (3 * y ** 2 - r2) / r5])
+        kernels[:, 0, 0] = 0.
+        kernelcache[(m, n)] = np.fft.rfft2(kernels)
+    return kernelcache[(m, n)]
+
+
+def dipolefield(theta):
+    '''
+    Field (bx, by) of all other arrows at every arrow, for the angles theta
+    in degrees, shape (m, n) or (batch, m, n).
+    '''
+    m, n = theta.shape[-2:]
+    kxx, kxy, kyy = dipolekernel(m, n)
+
+    # Magnetization transformed on the padded grid
+    thetarad = np.radians(theta)
+    fmx = np.fft.rfft2(np.cos(thetarad), s=(2 * m, 2 * n))
+    fmy = np.fft.rfft2(np.sin(thetarad), s=(2 * m, 2 * n))
+
+    # Convolution is a product after the FFT, keep the unpadded part
+    bx = np.fft.irfft2(kxx * fmx + kxy * fmy, s=(2 * m, 2 * n))[..., :m, :n]
+    by = np.fft.irfft2(kxy * fmx + kyy * fmy, s=(2 * m, 2 * n))[..., :m, :n]
+    return bx, by
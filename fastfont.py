@@ -1,4 +1,5 @@
 import pygame as pg
+from collections import OrderedDict
 
 class Fastfont:
     """ 
@@ -7,7 +8,10 @@ class Fastfont:
     Methods:
         CFastfont(screen,name,size,color,bold,italic) :  constructor, renders font
         
-        printat(screen,x,y,text): print text at x,y, at screen window (blit)
+        printat(screen,x,y,text): print text at x,y, at screen window (blit),
+                                  returns the rect of the printed text
+        render(screen,text): text bitmap, kept in a cache of the last used
+                             cachesize texts, so it is rendered only once
         setpos(x,y)   : not used anymore?
 
     Members: see create
@@ -15,10 +19,15 @@ class Fastfont:
     Created by  : Jacco M. Hoekstra
     """
 
-    def __init__(self,screen,name,size,color,bold,italic,swposx=-1,swposy=-1):
+    def __init__(self,screen,name,size,color,bold,italic,swposx=-1,swposy=-1,
+                 cachesize=64):
         self.swposx = swposx  # Default x = left side
         self.swposy = swposy  # Default y = top
 
+        # Rendered texts, least recently used first
+        self.cache = OrderedDict()
+        self.cachesize = cachesize
+
         pfont = pg.font.SysFont(name,size,bold,italic)
 
         # Render font
@@ -36,7 +45,11 @@ class Fastfont:
         del pfont
         return
 
-    def printat(self, screen, x, y, text, ctr=False):
+    def render(self, screen, text):
+        # Reuse the bitmap if this text was rendered before
+        if text in self.cache:
+            self.cache.move_to_end(text)
+            return self.cache[text]
 
         w = 0
         for ch in text:
@@ -60,6 +73,15 @@ class Fastfont:
 
                 txtimg.blit(self.chmaps[ich-32],dest,None,pg.BLEND_ADD)
 
+        # Keep in cache, drop the least recently used text when full
+        self.cache[text] = txtimg
+        if len(self.cache) > self.cachesize:
+            self.cache.popitem(last=False)
+        return txtimg
+
+    def printat(self, screen, x, y, text, ctr=False):
+
+        txtimg = self.render(screen, text)
         dest = txtimg.get_rect()    
 
         # Set position
@@ -80,7 +102,8 @@ class Fastfont:
         # Paste it onto the screen
         screen.blit(txtimg,dest,None,pg.BLEND_ADD)
 
-        return
+        # Area of the screen that was changed
+        return dest
 
     def setpos(self,swposx,swposy):
         self.swposx = swposx
@@ -1,4 +1,7 @@
 import os
+import glob
+import hashlib
+import numpy as np
 import pygame as pg
 from fastfont import Fastfont
 
@@ -18,38 +21,91 @@ def clock():
     time = pg.time.get_ticks()*0.001
     return time
 
-#Class
-class Arrowimg():
+# Loaded images by file name, shared so every file is read only once
+imagecache = {}
+
+def loadimage(fname):
     '''
-    Most of the arrow graphics. This class handles the image and the "Rect".
-    Needs the imglist so it can quickly update to correct angle.
+    Loads an image file with alpha channel, or returns the surface loaded
+    before from the same file. Needs the display to be set up.
     '''
-    def __init__(self,posx,posy,imglist):
-        self.imglist = imglist
-        fname = os.path.join('bitmaps','arrow.png')
-        img_source = pg.image.load(fname).convert_alpha()
-        self.img = img_source.copy()
-        rectarrow = pg.Rect(posx,posy,10,10)
-        img_rect = img_source.get_rect(center=rectarrow.center)
-        self.rect = self.img.get_rect(center=img_rect.center)
+    if fname not in imagecache:
+        imagecache[fname] = pg.image.load(fname).convert_alpha()
+    return imagecache[fname]
 
-    def update(self, theta):
-        '''
-        Takes in any float theta and
-        Loads the nearest integer angle,
-        as imglist contains 360 images.
-        '''
-        angle = int(theta+.5)%360
-        self.img = self.imglist[angle]
-        self.rect = self.img.get_rect(center=self.rect.center)
+# Rotated arrow images are stored in one atlas image of 20 x 18 cells
+atlascols, atlasrows = 20, 18
 
+def loadrotations(fname):
+    '''
+    Returns a list with the image rotated over 0-359 degrees.
+    All rotations are cached in one atlas image in the sprites folder, named
+    with a hash of the source image, so loading takes one read and the atlas
+    is only rebuilt when the source image changes.
+    '''
+    # Hash of the source image contents
+    f = open(fname,"rb")
+    srchash = hashlib.sha1(f.read()).hexdigest()[:12]
+    f.close()
+    atlasname = os.path.join('sprites','arrowatlas-'+srchash+'.png')
+
+    if os.path.exists(atlasname):
+        print("Loading rotated arrow images")
+        atlas = pg.image.load(atlasname).convert_alpha()
+        cellw = atlas.get_width()//atlascols
+        cellh = atlas.get_height()//atlasrows
+    else:
+        print("Creating rotated arrow images")
+        img_source = loadimage(fname)
+        rotations = [pg.transform.rotate(img_source, i) for i in range(360)]
+
+        # Cells fit the largest rotation, every image centered in its cell
+        cellw = max([img.get_width() for img in rotations])
+        cellh = max([img.get_height() for img in rotations])
+        atlas = pg.Surface((atlascols*cellw, atlasrows*cellh), pg.SRCALPHA)
+        for i in range(360):
+            x = (i%atlascols)*cellw + cellw//2
+            y = (i//atlascols)*cellh + cellh//2
+            atlas.blit(rotations[i], rotations[i].get_rect(center=(x,y)))
+
+        # Remove atlases of an older source image, save the new one
+        for oldname in glob.glob(os.path.join('sprites','arrowatlas-*.png')):
+            os.remove(oldname)
+        pg.image.save(atlas, atlasname)
+        atlas = atlas.convert_alpha()
+
+    # Slice the atlas into one subsurface per angle
+    imglist = []
+    for i in range(360):
+        x = (i%atlascols)*cellw
+        y = (i//atlascols)*cellh
+        imglist.append(atlas.subsurface((x,y,cellw,cellh)))
+    return imglist
+
+def scalerotations(imglist,scale):
+    '''
+    Returns the rotated images scaled down, by scaling their atlas once.
+    '''
+    atlas = imglist[0].get_parent()
+    cellw = max(1,int(imglist[0].get_width()*scale))
+    cellh = max(1,int(imglist[0].get_height()*scale))
+    small = pg.transform.smoothscale(atlas,(atlascols*cellw,atlasrows*cellh))
+
+    # Slice the small atlas into one subsurface per angle
+    smalllist = []
+    for i in range(360):
+        x = (i%atlascols)*cellw
+        y = (i//atlascols)*cellh
+        smalllist.append(small.subsurface((x,y,cellw,cellh)))
+    return smalllist
 
+#Class
 class GUI():
     '''
     Graphical User Interface class,
     set up, clear update and draw screen.
     '''
-    def __init__(self,caption,xmax,ymax):
+    def __init__(self,caption,xmax,ymax,dirtyupdates=True,fps=60,idlefps=5):
 
         # Initialize pygame
         pg.init()
@@ -62,45 +118,19 @@ class GUI():
         pg.display.set_icon(pg.image.load("icon.gif"))
 
         # Load rotated images into imagelist for all angle 0-359 deg
-        self.imglist = []
-        print("Loading rotated arrow images",end="")
-
-        # Load original arrow image, for if rotation is necessary
         fname = os.path.join('bitmaps','arrow.png')
-        img_source = pg.image.load(fname).convert_alpha()
-
-        
-        # Loading all rotated images, if not exist, rotate and save
-        for i in range(360):
-
-            # Show progress bar with points
-            if i%30==0:
-                print(".",end="")
-
-            # Load from (or save in) sprites folder
-            spritename = os.path.join('sprites', 'arrow' + str(i) + '.png') 
-
-            if os.path.exists(spritename):
-                img = pg.image.load(spritename).convert_alpha()
-            else:
-                img = pg.transform.rotate(img_source, i).convert_alpha()
-                pg.image.save(img, spritename)
-
-            # Add to rotated arrow img to imglist
-            self.imglist.append(img)
-                
-        print()
+        self.imglist = loadrotations(fname)
 
         # Display panel bitmap
-        self.panelimg = pg.image.load(os.path.join('bitmaps','displays-h130.png'))
+        self.panelimg = loadimage(os.path.join('bitmaps','displays-h130.png'))
         self.panelrect = self.panelimg.get_rect()
 
         # Light button images, same size, so we can use same rect object)
-        self.imgb0on  = pg.transform.scale(pg.image.load(os.path.join('bitmaps','B0on.png')),(50,40))
-        self.imgb0off = pg.transform.scale(pg.image.load(os.path.join('bitmaps','B0off.png')),(50,40))
-        self.imgb1on  = pg.transform.scale(pg.image.load(os.path.join('bitmaps','B1on.png')),(50,40))
-        self.imgb1off = pg.transform.scale(pg.image.load(os.path.join('bitmaps','B1off.png')),(50,40))
-        self.imgreset = pg.transform.scale(pg.image.load(os.path.join('bitmaps', 'RESET.png')), (50, 40))
+        self.imgb0on  = pg.transform.scale(loadimage(os.path.join('bitmaps','B0on.png')),(50,40))
+        self.imgb0off = pg.transform.scale(loadimage(os.path.join('bitmaps','B0off.png')),(50,40))
+        self.imgb1on  = pg.transform.scale(loadimage(os.path.join('bitmaps','B1on.png')),(50,40))
+        self.imgb1off = pg.transform.scale(loadimage(os.path.join('bitmaps','B1off.png')),(50,40))
+        self.imgreset = pg.transform.scale(loadimage(os.path.join('bitmaps', 'RESET.png')), (50, 40))
         self.imgbrect = self.imgb0on.get_rect()
 
         # Button positions
@@ -112,24 +142,65 @@ class GUI():
         self.panelx0  = int(self.xmax/2)-int(self.panelrect.width/2)+100
         self.panely0  = 20
 
+        # Area below the display panel and buttons, for large grids
+        self.gridarea = pg.Rect(10,170,self.xmax-20,self.ymax-180)
+
         # Create font objects
         self.font = Fastfont(self.screen,'Arial',17,white,True,False)
         self.dispfont = Fastfont(self.screen,'Arial',25,white,True,0,0) # 0,0 = center this font in x and y
         #       (pygame screen, font,size,   colour RGB,bold,italic)
 
+        # Static parts of the screen, drawn once in a cached background
+        self.makebackground()
 
+        # Area for the frame profiler HUD, below the key controls
+        self.hudrect = pg.Rect(6,100,self.panelrect.left-12,64)
+        self.hudlines = None
 
-    def textpanel(self,b0mag,b1mag,b1freq,b0on,b1on):
+        # Dirty rectangles: only redraw and update the changed parts of the
+        # screen. Without it (or after setarrows) the whole screen is redrawn.
+        self.dirtyupdates = dirtyupdates
+        self.redrawall = True
+        self.dirtyrects = []
+
+        # Last drawn values, to know what changed
+        self.disptext, self.disprect = {}, {}
+        self.buttons = None
+        self.angles = None
+
+        # Frame pacing: fps frames per second, idlefps when the window is
+        # minimized or has no focus (0 is no limit), see tick
+        self.fps, self.idlefps = fps, idlefps
+        self.pgclock = pg.time.Clock()
+        self.focused = True
+
+    def tick(self):
         '''
-        Displays the text panel listing the key controls on the left,
-        the B0/B1 on/off buttons and the RESET button on the right.
-        (NOT the increase/decrease buttons for B0/B1 magnitude and B1 freq)
+        Waits until it is time for the next frame, sleeping so the CPU is
+        free in the meantime. Slower when the window is not in view.
         '''
+        if self.focused and pg.display.get_active():
+            self.pgclock.tick(self.fps)
+        else:
+            self.pgclock.tick(self.idlefps)
 
-        # Blit background image for display panel, center of screen
+    def makebackground(self):
+        '''
+        Composes the parts of the screen that never change (black background,
+        border, display panel image and key controls text) once into one
+        cached background surface.
+        '''
+        self.background = pg.Surface((self.xmax,self.ymax)).convert()
+        self.background.fill(black)
+
+        # Draw a border
+        dx = 4
+        pg.draw.rect(self.background,blue,self.background.get_rect(),dx)
+
+        # Background image for display panel, center of screen
         self.panelrect.centerx = int(self.xmax / 2) + 100
         self.panelrect.y = self.panely0
-        self.screen.blit(self.panelimg, self.panelrect)
+        self.background.blit(self.panelimg, self.panelrect)
 
         # Text
 
@@ -138,18 +209,34 @@ class GUI():
         y = 5
         dy = 15
 
-        self.font.printat(self.screen,xtxt,y,"===  KEY CONTROLS  ===")
+        self.font.printat(self.background,xtxt,y,"===  KEY CONTROLS  ===")
         y += dy
-        self.font.printat(self.screen,xtxt,y,"B0 = Left/Right keys")
+        self.font.printat(self.background,xtxt,y,"B0 = Left/Right keys")
         y += dy
-        self.font.printat(self.screen,xtxt,y,"B1 = Down/Up keys ")
+        self.font.printat(self.background,xtxt,y,"B1 = Down/Up keys ")
         y += dy
-        self.font.printat(self.screen,xtxt,y,"B1freq = Minus/Plus keys")
+        self.font.printat(self.background,xtxt,y,"B1freq = Minus/Plus keys")
         y += dy
-        self.font.printat(self.screen,xtxt,y,"Quit = ESC key")
+        self.font.printat(self.background,xtxt,y,"Quit = ESC key")
         y += dy
         #self.font.printat(screen,xtxt,y,"Reset vel: v")
 
+    def restore(self,rect):
+        '''
+        Draws the cached background over rect and marks it for updating.
+        '''
+        self.screen.blit(self.background,rect,rect)
+        self.dirtyrects.append(rect)
+
+    def textpanel(self,b0mag,b1mag,b1freq,b0on,b1on):
+        '''
+        Displays the values in the display panel, the B0/B1 on/off buttons
+        and the RESET button on the right. The key controls text on the left
+        and the panel itself are part of the cached background.
+        (NOT the increase/decrease buttons for B0/B1 magnitude and B1 freq)
+        Only values and buttons that changed are drawn again, unless the
+        whole screen is redrawn.
+        '''
         # Positon of values in displays
 
         # Use display panel x-coordinate to set text x-coordinate
@@ -157,59 +244,233 @@ class GUI():
         xb0 = self.panelx0 + 99
         xb1  = self.panelx0 + 307
         xb1f = self.panelx0 + 521
-        self.dispfont.printat(self.screen, xb0, yb0, str(round(b0mag, 3)))
-        self.dispfont.printat(self.screen, xb1, yb0, str(round(b1mag, 3)))
-        self.dispfont.printat(self.screen, xb1f, yb0, str(round(b1freq, 3)) + " Hz")
-
-        # Button for B0 on/off
-        self.imgbrect.center = self.B0xy
-        if b0on:
-            self.screen.blit(self.imgb0on,self.imgbrect)
-        else:
-            self.screen.blit(self.imgb0off,self.imgbrect)
+        displays = [(xb0, str(round(b0mag, 3))),
+                    (xb1, str(round(b1mag, 3))),
+                    (xb1f, str(round(b1freq, 3)) + " Hz")]
+
+        for x,text in displays:
+            if self.redrawall or self.disptext.get(x) != text:
+                # Wipe the previous value
+                if not self.redrawall and x in self.disprect:
+                    self.restore(self.disprect[x])
+
+                rect = self.dispfont.printat(self.screen, x, yb0, text)
+                self.dirtyrects.append(rect)
+                self.disptext[x] = text
+                self.disprect[x] = rect
+
+        # Buttons, only drawn when switched
+        if self.redrawall or self.buttons != (b0on,b1on):
+            self.buttons = (b0on,b1on)
+
+            # Button for B0 on/off
+            self.imgbrect.center = self.B0xy
+            self.restore(self.imgbrect.copy())
+            if b0on:
+                self.screen.blit(self.imgb0on,self.imgbrect)
+            else:
+                self.screen.blit(self.imgb0off,self.imgbrect)
 
-        # Button for B1 on/off
-        self.imgbrect.center = self.B1xy
-        if b1on:
-            self.screen.blit(self.imgb1on,self.imgbrect)
-        else:
-            self.screen.blit(self.imgb1off,self.imgbrect)
+            # Button for B1 on/off
+            self.imgbrect.center = self.B1xy
+            self.restore(self.imgbrect.copy())
+            if b1on:
+                self.screen.blit(self.imgb1on,self.imgbrect)
+            else:
+                self.screen.blit(self.imgb1off,self.imgbrect)
 
-        # RESET button
-        self.imgbrect.center = self.RESETxy
-        self.screen.blit(self.imgreset, self.imgbrect)
+            # RESET button
+            self.imgbrect.center = self.RESETxy
+            self.restore(self.imgbrect.copy())
+            self.screen.blit(self.imgreset, self.imgbrect)
 
-    def drawarrows(self,arrowlist,m,n):
+    def drawhud(self,lines):
         '''
-        Goes through the nested list (to represent the two dimensions) with
-        Arrowimg objects and displays each one at the correct position and angle.
+        Shows lines of text (the frame profiler times) below the key
+        controls. Only drawn again when the text changed.
         '''
-        for i in range(m):
-            for j in range(n):
-                # Slicing looks weird because it's a nested list
-                # To put the image on the screen, we blit the image and Rect
-                self.screen.blit(arrowlist[i][j].img, arrowlist[i][j].rect)
+        if self.redrawall or lines != self.hudlines:
+            self.hudlines = lines
+            self.restore(self.hudrect)
+
+            # Keep long lines out of the display panel
+            self.screen.set_clip(self.hudrect)
+            y = self.hudrect.top
+            for line in lines:
+                self.font.printat(self.screen,self.hudrect.left,y,line)
+                y += 15
+            self.screen.set_clip(None)
+
+    def setarrows(self,m,n,view="arrows",maxarrows=400):
+        '''
+        Sets up the positions of the m x n grid of arrows on the screen.
+        The model itself has no graphics, so the GUI keeps the arrows.
+        Level of detail for large grids: with more than maxarrows arrows
+        only every step-th arrow in x and y is drawn, and arrows are drawn
+        smaller when close together. With view "heatmap" the angles are
+        shown as colours instead, in one image for any grid size.
+        '''
+        self.view = view
+
+        # New arrows, so draw everything in the next frame
+        self.redrawall = True
+        self.angles = None
+
+        if view == "heatmap":
+            self.setheatmap(m,n)
+            return
+
+        # Draw every step-th arrow, as a smaller grid
+        self.step = int(np.ceil(np.sqrt(m*n/maxarrows)))
+        m = (m + self.step - 1)//self.step
+        n = (n + self.step - 1)//self.step
+
+        # Pixel distance between compass arrows
+        xdist = self.xmax / (m + 1)
+        ydist = self.ymax / (n + 2)
+
+        # + 1 because the centers are half distance from borders on each side
+        # Arrays with the x and y pixel positions of the compass arrows
+        xposarr = np.arange(xdist, self.xmax, xdist)
+        yposarr = np.arange(2.0 * ydist, self.ymax, ydist)
+
+        # Too many rows to fit below the panel this way, so spread them over
+        # the area below the panel (positions 5 pixels before the center)
+        if 1.5 * ydist < self.gridarea.top:
+            xdist = self.gridarea.width / m
+            ydist = self.gridarea.height / n
+            xposarr = self.gridarea.left + (np.arange(m) + .5) * xdist - 5
+            yposarr = self.gridarea.top + (np.arange(n) + .5) * ydist - 5
+
+        # Arrow centers, like the center of a 10x10 pixel rect at the position
+        xctr = xposarr[:m].astype(int) + 5
+        yctr = yposarr[:n].astype(int) + 5
+
+        # Smaller arrow images when the arrows are close together
+        imglist = self.imglist
+        scale = 1.5*min(xdist,ydist)/imglist[0].get_width()
+        if scale < 1.:
+            imglist = scalerotations(imglist,scale)
+
+        # All rotated images have the same size (cells of the atlas), so the
+        # top left blit positions are fixed, in the order of theta.ravel()
+        imgw, imgh = imglist[0].get_size()
+        xpos, ypos = np.meshgrid(xctr - imgw//2, yctr - imgh//2, indexing="ij")
+        self.arrowpos = list(zip(xpos.ravel().tolist(), ypos.ravel().tolist()))
+
+        # Rects of all arrows, to find the neighbours of a changed arrow,
+        # and the area with all arrows
+        self.arrowrects = [pg.Rect(x,y,imgw,imgh) for x,y in self.arrowpos]
+        self.arrowarea = self.arrowrects[0].unionall(self.arrowrects)
+        self.arrowarea = self.arrowarea.clip(self.screen.get_rect())
+
+        # Images in an array, so all arrow images are picked with one index
+        self.imgarray = np.empty(360, dtype=object)
+        for i in range(360):
+            self.imgarray[i] = imglist[i]
 
-    def clearscreen(self):
+    def setheatmap(self,m,n):
         '''
-        Pygame doesn't get rid of the previous frame by itself, so a
-        function is needed to clear the screen unless. Done here by simply
-        drawing a black rectangle over everything.
+        Sets up the heatmap view: every arrow a pixel coloured by its angle,
+        scaled up to fit below the display panel.
+        '''
+        # Area below the panel, with square cells
+        area = self.gridarea
+        cell = min(area.width/m,area.height/n)
+        self.heatrect = pg.Rect(0,0,max(1,int(m*cell)),max(1,int(n*cell)))
+        self.heatrect.center = area.center
+        self.arrowarea = self.heatrect
+
+        # Colour (hue) for every angle 0-359, so picked with one index
+        hue = np.arange(360)/60.
+        rgb = np.array([np.abs(hue-3)-1, 2-np.abs(hue-2), 2-np.abs(hue-4)])
+        self.huelut = (255*np.clip(rgb,0,1).T).astype(np.uint8)
+
+        # Surfaces for the pixels and for the scaled image, reused every frame
+        self.heatsurf = pg.Surface((m,n))
+        self.heatscaled = pg.Surface(self.heatrect.size)
+
+    def drawheatmap(self,theta):
+        '''
+        Displays the angles of all arrows as colours, in one blit.
+        '''
+        angles = (theta+.5).astype(int)%360
+        pg.surfarray.blit_array(self.heatsurf,self.huelut[angles])
+        pg.transform.scale(self.heatsurf,self.heatrect.size,self.heatscaled)
+        self.screen.blit(self.heatscaled,self.heatrect)
+        self.dirtyrects.append(self.heatrect)
+
+    def drawarrows(self,theta):
+        '''
+        Displays all arrows at their position, with the image of the nearest
+        integer angle from the theta array (imglist contains 360 images).
+        With dirty rectangles only arrows with a new image are drawn again.
+        For large grids only every step-th arrow is drawn, or the heatmap.
         '''
-        self.screen.fill(black)
-        rect = self.screen.get_rect()
+        if self.view == "heatmap":
+            self.drawheatmap(theta)
+            return
 
+        # Level of detail: only the arrows that are drawn
+        theta = theta[::self.step,::self.step]
 
-        # Draw a border
-        dx = 4
-        pg.draw.rect(self.screen,blue,rect,dx)
+        # Image index for every arrow at once
+        angles = ((theta+.5).astype(int)%360).ravel()
+
+        # Arrows that turned to another image
+        if not self.redrawall and self.angles is not None:
+            changed = np.flatnonzero(angles != self.angles)
 
+            # When most arrows changed, wiping the whole arrow area is faster
+            if len(changed) > len(angles)//4:
+                self.restore(self.arrowarea)
+                redrawall = True
+            else:
+                redrawall = False
+        else:
+            redrawall = True
+
+        if redrawall:
+            # Put all images on the screen in one call
+            imgs = self.imgarray[angles]
+            self.screen.blits(zip(imgs, self.arrowpos), doreturn=False)
+        else:
+            # Only the arrows that changed
+            for k in changed:
+                # Wipe the arrow and redraw the arrows overlapping its rect,
+                # clipped, so overlapping edges are not drawn twice
+                rect = self.arrowrects[k]
+                self.screen.set_clip(rect)
+                self.restore(rect)
+                near = rect.collidelistall(self.arrowrects)
+                self.screen.blits([(self.imgarray[angles[i]], self.arrowpos[i])
+                                   for i in near], doreturn=False)
+            self.screen.set_clip(None)
+
+        self.angles = angles
+
+    def clearscreen(self):
+        '''
+        Pygame doesn't get rid of the previous frame by itself, so a
+        function is needed to clear the screen unless. Done here by
+        drawing the cached background (black, border, panel, key controls)
+        over everything. With dirty rectangles this is only needed when the
+        whole screen is redrawn, otherwise only changed parts are wiped.
+        '''
+        if self.redrawall:
+            self.screen.blit(self.background,(0,0))
 
     def updatescreen(self):
         '''
-        Display all the prepared elements of a frame.
+        Display all the prepared elements of a frame: the whole screen,
+        or with dirty rectangles only the parts that changed.
         '''
-        pg.display.flip()
+        if self.redrawall:
+            pg.display.flip()
+        else:
+            pg.display.update(self.dirtyrects)
+        self.dirtyrects = []
+        self.redrawall = not self.dirtyupdates
 
     def getkeys(self):
         '''
@@ -241,6 +502,17 @@ class GUI():
             if event.type==pg.QUIT:
                 activekeys.append(keynames[pg.K_ESCAPE])
 
+            # Window lost or got the focus, for the frame rate
+            elif event.type == pg.WINDOWFOCUSLOST:
+                self.focused = False
+            elif event.type == pg.WINDOWFOCUSGAINED:
+                self.focused = True
+
+            # Window uncovered or restored: the system may have lost what was
+            # on it, so the next frame draws the whole screen again
+            elif event.type in (pg.VIDEOEXPOSE, pg.WINDOWEXPOSED, pg.WINDOWRESTORED):
+                self.redrawall = True
+
             # Mouse clicked on buttons
             elif event.type == pg.MOUSEBUTTONUP:
                 mousex,mousey = event.pos
@@ -0,0 +1,157 @@
+"""
+Imaging the tissue: a spin warp (2D Fourier) acquisition on top of Model,
+followed by an FFT reconstruction of the tissue map.
+
+Every phase encoding line is one experiment of a batch Model:
+    1. excitation: B1 at the centre frequency f0 tips the arrows
+    2. phase encoding: a B0 gradient along y for tphase
+    3. readout: a B0 gradient along x for tread, while the summed transverse
+       signal of all arrows is recorded every time step in the k-space buffer
+The gradients are made by scaling the B0 gradient array of the model, so an
+arrow with tissue factor 1 gets exactly the wanted frequency offset. Tissue
+changes the arrow frequency as well (not only the signal), which shifts
+weaker tissue in the readout direction, like a chemical shift in MRI.
+
+Many acquisitions (tissues) are done at once in the same batch, so the
+reconstruction quality can be compared for different acquisition times.
+
+Example, image two tissues with all or half of the phase encoding lines:
+    python imaging.py --tissue tissue1 tissue2 --lines 4 2
+"""
+import argparse
+import numpy as np
+from model import Model
+from resonance import centerfreq
+
+
+def setgradient(model, base, f0, fx, fy):
+    '''
+    Programmable B0 gradient: scales the base B0 gradient array so arrow
+    (i, j) with tissue factor 1 gets a frequency offset of fx (i - m//2) +
+    fy (j - n//2) Hz from f0. fx and fy may be arrays per experiment.
+    '''
+    x = np.arange(model.m).reshape(-1, 1) - model.m // 2
+    y = np.arange(model.n).reshape(1, -1) - model.n // 2
+    offset = fx * x + fy * y
+
+    # Frequency goes with the square root of the B0 field
+    model.b0gradient = base * ((f0 + offset) / f0) ** 2
+
+
+def acquire(tissuelist, m, n, lines=None, b0mag=4000., b1mag=300., gradient=None,
+            dt=0.01, seed=None, integrator="rk4"):
+    '''
+    Acquires the k-space of every tissue in tissuelist in one batch Model.
+    lines is the number of phase encoding lines (default n, fewer is faster
+    but blurs along y), gradient the largest frequency offset [Hz] over the
+    grid (default a quarter of f0), stronger is faster but distorts more.
+    Returns the k-space, shape (tissues, lines, readout steps), and the
+    acquisition time per tissue [s].
+    '''
+    if lines is None:
+        lines = n
+    f0 = centerfreq(b0mag)
+    if gradient is None:
+        gradient = f0 / 4
+
+    # Timing of one line: one period excitation, then a phase encoding time
+    # and a readout time for a phase step and a frequency step of one arrow
+    nexcite = int(round(1 / f0 / dt))
+    nphase = int(round(n / (4 * gradient) / dt))
+    nread = int(round(m / (2 * gradient) / dt))
+    tphase, tread = nphase * dt, nread * dt
+
+    # One experiment per tissue and line, lines centred around k = 0
+    tissues = [tissue for tissue in tissuelist for k in range(lines)]
+    model = Model(b0mag, b1mag, f0, m, n, tissues, seed, integrator)
+    phasestep = np.tile(np.arange(lines) - lines // 2, len(tissuelist)).reshape(-1, 1, 1)
+    base = model.b0gradient
+
+    # Excitation by B1 at the centre frequency
+    tsim = model.run(0., dt, nexcite)
+    model.b1on = False
+
+    # Phase encoding: 2 pi phasestep (j - n//2) / n phase at the end
+    setgradient(model, base, f0, 0., phasestep / (n * tphase))
+    tsim = model.run(tsim, dt, nphase)
+
+    # Readout: frequency step of one arrow 1 / tread
+    setgradient(model, base, f0, 1. / tread, 0.)
+    kspace = np.empty((model.batch, nread), dtype=complex)
+    w0 = 2 * np.pi * f0
+    for k in range(nread):
+        # Transverse signal with its derivative as quadrature channel,
+        # demodulated at the centre frequency
+        thetarad = np.radians(model.theta)
+        signal = np.sin(thetarad) - 1j * np.cos(thetarad) * np.radians(model.v) / w0
+        kspace[:, k] = signal.sum(axis=(1, 2)) * np.exp(-1j * w0 * k * dt)
+        tsim = tsim + dt
+        model.update(tsim, dt)
+
+    kspace = kspace.reshape(len(tissuelist), lines, nread)
+    return kspace, lines * tsim
+
+
+def reconstruct(kspace, m, n):
+    '''
+    Tissue maps (tissues, m, n) from the k-space of acquire: FFT of the
+    oversampled readout, keeping the m frequencies of the grid, and FFT over
+    the phase encoding lines, zero filled to n lines. Scaled to a maximum of 1.
+    '''
+    nimages, lines, nread = kspace.shape
+
+    # Readout: arrow i is at frequency bin i - m//2
+    x = np.arange(m) - m // 2
+    profiles = np.fft.fft(kspace, axis=2)[:, :, x % nread]
+
+    # Phase encoding: missing lines are zero, arrow j at bin j - n//2
+    y = np.arange(n) - n // 2
+    full = np.zeros((nimages, n, m), dtype=complex)
+    full[:, (np.arange(lines) - lines // 2) % n] = profiles
+    images = np.abs(np.fft.fft(full, axis=1)[:, y % n]).transpose(0, 2, 1)
+    return images / images.max(axis=(1, 2), keepdims=True)
+
+
+def quality(images, masks):
+    '''
+    Compares reconstructed images with the tissue masks, both scaled to a
+    maximum of 1. Returns the RMS error and the correlation per image.
+    '''
+    masks = np.asarray(masks, dtype=float)
+    masks = masks / masks.max(axis=(-2, -1), keepdims=True)
+    rmse = np.sqrt(np.mean((images - masks) ** 2, axis=(-2, -1)))
+
+    # Pearson correlation, NaN for a uniform mask
+    a = images - images.mean(axis=(-2, -1), keepdims=True)
+    b = masks - masks.mean(axis=(-2, -1), keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = (a * b).sum(axis=(-2, -1)) / np.sqrt((a ** 2).sum(axis=(-2, -1)) *
+                                                    (b ** 2).sum(axis=(-2, -1)))
+    return rmse, corr
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless MRI 2D imaging benchmark")
+    parser.add_argument("--tissue", nargs="+", default=["tissue1"], help="tissue files in data")
+    parser.add_argument("--size", nargs=2, type=int, default=[5, 4], help="grid m n")
+    parser.add_argument("--lines", nargs="+", type=int, default=[4], help="phase encoding lines")
+    parser.add_argument("--gradient", nargs="+", type=float, default=[None],
+                        help="largest gradient frequency offset [Hz]")
+    parser.add_argument("--b0", type=float, default=4000., help="B0 magnitude")
+    parser.add_argument("--b1", type=float, default=300., help="B1 magnitude")
+    parser.add_argument("--dt", type=float, default=0.01, help="time step [s]")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the noise")
+    args = parser.parse_args()
+    m, n = args.size
+
+    print("tissue, lines, gradient [Hz], acquisition time [s], RMS error, correlation")
+    for lines in args.lines:
+        for gradient in args.gradient:
+            kspace, tacq = acquire(args.tissue, m, n, lines, args.b0, args.b1, gradient,
+                                   args.dt, args.seed)
+            images = reconstruct(kspace, m, n)
+            masks = Model(args.b0, args.b1, 1., m, n, list(args.tissue)).tissuemask
+            rmse, corr = quality(images, masks)
+            for k, tissue in enumerate(args.tissue):
+                print("%s, %d, %s, %.1f, %.3f, %.3f" % (tissue, lines, gradient, tacq,
+                                                          rmse[k], corr[k]))
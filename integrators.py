@@ -0,0 +1,115 @@
+"""
+Time integrators for the compass arrows.
+Every integrator takes the acceleration function a(t, theta, v), the start
+time t, the time step dt and the theta and v arrays (any shape, so also
+batch mode), and returns theta and v at t + dt.
+"""
+import numpy as np
+
+
+def symplectic(accel, t, dt, theta, v):
+    '''
+    Semi-implicit (symplectic) Euler, the original integration of Model:
+    new velocity from the acceleration, then theta from the new velocity.
+    '''
+    a = accel(t + dt, theta, v)
+    v = v + a * dt
+    theta = theta + v * dt
+    return theta, v
+
+
+def verlet(accel, t, dt, theta, v):
+    '''
+    Velocity Verlet, second order. The damping depends on v, so the second
+    acceleration uses a predicted end velocity (the half step velocity
+    there would make it first order with damping).
+    '''
+    a0 = accel(t, theta, v)
+    vhalf = v + 0.5 * a0 * dt
+    theta = theta + vhalf * dt
+    a1 = accel(t + dt, theta, v + a0 * dt)
+    v = vhalf + 0.5 * a1 * dt
+    return theta, v
+
+
+def rk4(accel, t, dt, theta, v):
+    '''Classic fourth order Runge-Kutta on the state (theta, v).'''
+    k1x, k1v = v, accel(t, theta, v)
+    k2x, k2v = v + 0.5 * dt * k1v, accel(t + 0.5 * dt, theta + 0.5 * dt * k1x, v + 0.5 * dt * k1v)
+    k3x, k3v = v + 0.5 * dt * k2v, accel(t + 0.5 * dt, theta + 0.5 * dt * k2x, v + 0.5 * dt * k2v)
+    k4x, k4v = v + dt * k3v, accel(t + dt, theta + dt * k3x, v + dt * k3v)
+    theta = theta + dt / 6 * (k1x + 2 * k2x + 2 * k3x + k4x)
+    v = v + dt / 6 * (k1v + 2 * k2v + 2 * k3v + k4v)
+    return theta, v
+
+
+# Dormand-Prince 5(4) coefficients
+dpc = np.array([0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1, 1])
+dpa = [[],
+       [1 / 5],
+       [3 / 40, 9 / 40],
+       [44 / 45, -56 / 15, 32 / 9],
+       [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+       [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+       [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84]]
+dpb5 = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0])
+dpb4 = np.array([5179 / 57600, 0, 7571 / 16695, 393 / 640, -92097 / 339200,
+                 187 / 2100, 1 / 40])
+
+
+def rk45(accel, t, dt, theta, v, rtol=1e-6, atol=1e-3):
+    '''
+    Adaptive Dormand-Prince RK45. Integrates over dt with as many internal
+    steps as the error control needs: the error estimate from the embedded
+    fourth order solution must stay within atol + rtol * |state| (in degrees
+    and degrees/s) for all arrows. Large dt can so be taken where possible.
+    Raises a ValueError when the error is not finite or the step gets
+    smaller than 1e-12 dt, instead of looping forever.
+    '''
+    tend = t + dt
+    h = dt
+    hmin = 1e-12 * dt
+    while t < tend:
+        h = min(h, tend - t)
+
+        # Stages for theta (kx) and v (kv)
+        kx, kv = [], []
+        for i in range(7):
+            x, u = theta, v
+            for j in range(i):
+                x = x + h * dpa[i][j] * kx[j]
+                u = u + h * dpa[i][j] * kv[j]
+            kx.append(u)
+            kv.append(accel(t + dpc[i] * h, x, u))
+
+        # Fifth order solution and difference with fourth order for the error
+        x5, u5, errx, erru = theta, v, 0., 0.
+        for i in range(7):
+            x5 = x5 + h * dpb5[i] * kx[i]
+            u5 = u5 + h * dpb5[i] * kv[i]
+            errx = errx + h * (dpb5[i] - dpb4[i]) * kx[i]
+            erru = erru + h * (dpb5[i] - dpb4[i]) * kv[i]
+
+        scalex = atol + rtol * np.maximum(np.abs(theta), np.abs(x5))
+        scaleu = atol + rtol * np.maximum(np.abs(v), np.abs(u5))
+        err = max(np.max(np.abs(errx) / scalex), np.max(np.abs(erru) / scaleu))
+        if not np.isfinite(err):
+            raise ValueError("rk45: error estimate is not finite at t = %g" % t)
+
+        # Accept the step if within tolerance, then adapt the step size
+        if err <= 1.:
+            t = t + h
+            theta, v = x5, u5
+        h = h * min(5., max(0.2, 0.9 * (1. / max(err, 1e-10)) ** 0.2))
+        if err > 1. and h < hmin:
+            raise ValueError("rk45: step size below %g at t = %g" % (hmin, t))
+
+    return theta, v
+
+
+# Integrators by name, "euler" is the original method
+integrators = {"euler": symplectic,
+               "symplectic": symplectic,
+               "verlet": verlet,
+               "rk4": rk4,
+               "rk45": rk45}
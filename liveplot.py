@@ -0,0 +1,107 @@
+"""
+Live strip charts of B0, B1 frequency, theta and the std dev of theta,
+drawn by matplotlib in a separate process while the simulation runs.
+The simulation only puts samples in a queue and never waits for plotting.
+"""
+import queue
+import multiprocessing
+import numpy as np
+
+
+class Liveplot():
+    '''
+    Starts the plot process and feeds it samples.
+    Samples are dropped when the plot process can't keep up.
+    At most maxlines arrows are drawn in the theta plot.
+    '''
+    def __init__(self, interval=0.2, maxpoints=1000, maxlines=20):
+        self.maxlines = maxlines
+
+        # Spawn a fresh process, don't fork the one running pygame
+        context = multiprocessing.get_context("spawn")
+        self.queue = context.Queue(maxsize=1000)
+        self.process = context.Process(target=plotloop,
+                                       args=(self.queue, interval, maxpoints),
+                                       daemon=True)
+        self.process.start()
+
+    def add(self, tsim, b0mag, b1freq, dev, allthetas):
+        '''Sends one sample to the plot process, skipped if the queue is full.'''
+        # Evenly spread selection of arrows
+        step = max(1, len(allthetas) // self.maxlines)
+        try:
+            self.queue.put_nowait((tsim, b0mag, b1freq, dev, allthetas[::step].copy()))
+        except queue.Full:
+            pass
+
+    def close(self):
+        '''Stops the plot process.'''
+        try:
+            self.queue.put(None, timeout=1.)
+        except queue.Full:
+            pass
+        self.process.join(timeout=2.)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def plotloop(samples, interval, maxpoints):
+    '''
+    Plot process: collects samples from the queue and every interval
+    updates the existing lines with set_data, using at most maxpoints
+    points per line (decimated), until it gets None or the window closes.
+    '''
+    import matplotlib.pyplot as plt
+    from plotter import Timeseries
+
+    fig, axes = plt.subplots(4, 1, sharex=True)
+    titles = ["B0 field", "B1 freq [Hz]", "Theta", "Std Dev Theta"]
+    for ax, title in zip(axes, titles):
+        ax.set_title(title)
+    fig.tight_layout()
+
+    # Stored samples and lines, made at the first sample
+    tables = None
+    lines = None
+
+    running = True
+    while running and plt.fignum_exists(fig.number):
+        # Take all samples that are waiting
+        new = False
+        while True:
+            try:
+                sample = samples.get_nowait()
+            except queue.Empty:
+                break
+            if sample is None:
+                running = False
+                break
+            tsim, b0mag, b1freq, dev, thetas = sample
+            if tables is None:
+                tables = [Timeseries(), Timeseries(), Timeseries(),
+                          Timeseries((len(thetas),)), Timeseries()]
+                lines = [axes[0].plot([], [])[0], axes[1].plot([], [])[0],
+                         axes[2].plot(np.zeros((0, len(thetas))))[:],
+                         axes[3].plot([], [])[0]]
+            for table, value in zip(tables, (tsim, b0mag, b1freq, thetas, dev)):
+                table.append(value)
+            new = True
+
+        # Update the lines with the decimated data
+        if new:
+            step = max(1, len(tables[0]) // maxpoints)
+            t = tables[0].data()[::step]
+            lines[0].set_data(t, tables[1].data()[::step])
+            lines[1].set_data(t, tables[2].data()[::step])
+            thetas = np.mod(tables[3].data()[::step], 360)
+            for k in range(len(lines[2])):
+                lines[2][k].set_data(t, thetas[:, k])
+            lines[3].set_data(t, tables[4].data()[::step])
+            for ax in axes:
+                ax.relim()
+                ax.autoscale_view()
+
+        # Draws the figure and handles its window events
+        plt.pause(interval)
+
+    plt.close(fig)
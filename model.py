@@ -1,6 +1,8 @@
 import numpy as np
-from graphics import Arrowimg
-import os
+import itertools
+from integrators import integrators
+from tissue import loadtissue
+from coupling import dipolefield
 
 class Model():
     '''
@@ -8,34 +10,63 @@ class Model():
     It sets start values for physical quantities and contains calculations
     that are called upon every frame. It needs the time and timesteps as inputs,
     they are not regulated within this class. (See sim.py, the main program.)
-    '''    
-    def __init__(self, b0set, b1set, f1set, m, n, xmax, ymax, tissuefile, gui):
+    Pure NumPy, no pygame: the GUI only reads theta to draw the arrows, so
+    the model can also be stepped headless with run().
+
+    Batch mode: give b0set, b1set, f1set and/or tissuefile as lists (equal
+    length, or a single value for all) to simulate that many experiments
+    at once. All arrays then get shape (batch, m, n) and the settings shape
+    (batch, 1, 1), so force() and update() step every experiment together.
+
+    Give a seed for the noise on the B0 gradient to make runs reproducible.
+    The integrator is chosen by name from integrators.py ("euler", "verlet",
+    "rk4", "rk45", ...), higher order ones allow larger time steps.
+    With kcoupling not zero every arrow also feels the dipole field of all
+    other arrows, times kcoupling (see coupling.py).
+    A pulse sequence (see sequence.py) set with setsequence drives B1 and
+    switches B0 and B1 while it runs.
+    '''
+    def __init__(self, b0set, b1set, f1set, m, n, tissuefile="", seed=None,
+                 integrator="euler", kcoupling=0.):
         # Array size
         self.m,self.n = m,n
 
-        # Adjustable values
+        # Number of experiments in batch mode, None for a single experiment
+        self.batch = None
+        # (a tissue can be an array itself, so only a list of tissues counts)
+        batchsettings = [setting for setting in (b0set, b1set, f1set) if np.ndim(setting) > 0]
+        if isinstance(tissuefile, (list, tuple)):
+            batchsettings.append(tissuefile)
+        for setting in batchsettings:
+            if self.batch is not None and len(setting) != self.batch:
+                raise ValueError("Batch settings must have equal lengths")
+            self.batch = len(setting)
+
+        # Shape of all physics arrays
+        if self.batch is None:
+            shape = (m, n)
+        else:
+            shape = (self.batch, m, n)
+
+        # Adjustable values, in batch mode one per experiment
         self.b0mag, self.b1mag, self.b1freq = b0set, b1set, f1set
+        if self.batch is not None:
+            self.b0mag = self.batchsetting(b0set)
+            self.b1mag = self.batchsetting(b1set)
+            self.b1freq = self.batchsetting(f1set)
         self.kdamper = 0.6
+        self.kcoupling = kcoupling
 
-        # Pixel distance between compass arrows
-        xdist = xmax / (self.m + 1)
-        ydist = ymax / (self.n + 2)
-
-        # + 1 because the centers are half distance from borders on each side
-        # Arrays with the x and y pixel positions of the compass arrows
-        xposarr = np.arange(xdist, xmax, xdist)
-        yposarr = np.arange(2.0 * ydist, ymax, ydist)
+        # Time integration method, see integrators.py
+        self.integrator = integrator
+        if integrator not in integrators:
+            raise ValueError("Unknown integrator: " + str(integrator))
 
-        # Setting up the arrows
-        # Saving them in a 2D list so using the physics arrays will be easier
-        self.arrowlist = []
-        for i in range(m):
-            self.arrowlist.append([])
-            for j in range(n):
-                self.arrowlist[i].append(Arrowimg(xposarr[i], yposarr[j], gui.imglist))
-
-        # Simulating tissue in the grid
+        # Simulating tissue in the grid, one mask for all experiments
+        # in a batch is repeated
         self.readtissue(tissuefile)
+        if self.tissuemask.shape != shape:
+            self.tissuemask = self.tissuemask * np.ones(shape)
 
         # Starting the magnetic field arrays
         # Optional x gradient and y gradient to build magnetic fields on
@@ -48,58 +79,57 @@ class Model():
         # For realism, not every compass arrow is exactly identical, so add noise
         # Use gradient factor for noise
         self.noise = 0.03
-        self.b0gradient = 1 + self.noise * (np.random.rand(m, n) - 0.5)
-        self.b1gradient = 1 + 0 * self.b1gradient
+        self.seed = seed
+        random = np.random.RandomState(seed)
+        self.b0gradient = 1 + self.noise * (random.rand(*shape) - 0.5)
+        self.b1gradient = 1 + 0 * self.b1gradient * np.ones(shape)
 
         # Start with B0 and B1 oon
         self.b0on = True
         self.b1on = True
 
+        # No pulse sequence, B1 as set
+        self.sequence = None
+
         # Set up physics variables
         # Angles and angular velocities
         theta0 = 180.
-        self.theta, self.v = np.ones([m, n]) * theta0, np.zeros([m, n])
+        self.theta, self.v = np.ones(shape) * theta0, np.zeros(shape)
+
+    def batchsetting(self, setting):
+        '''
+        Turns a batch setting (list or single value) into a (batch,1,1)
+        array, so it broadcasts over the (batch,m,n) physics arrays.
+        '''
+        values = np.ones(self.batch) * np.asarray(setting, dtype=float)
+        return values.reshape(self.batch, 1, 1)
 
     def readtissue(self,tissuefile):
         '''
         Imports the file containing the properties of compasses
         by their coordinates, to simulate different tissues, and "image" them.
+        A tissue file can be a .tis/.csv text file, a .npy file or a grayscale
+        image in the data folder, or a 2D array, see tissue.py.
+        In batch mode tissuefile is a list, one tissue per experiment.
         '''
+        # Batch mode: stack the masks of all tissue files, read each file once
+        if isinstance(tissuefile, (list, tuple)):
+            masks = {}
+            for fname in tissuefile:
+                key = fname if isinstance(fname, str) else id(fname)
+                if key not in masks:
+                    self.readtissue(fname)
+                    masks[key] = self.tissuemask
+            self.tissuemask = np.array([masks[fname if isinstance(fname, str) else id(fname)]
+                                        for fname in tissuefile])
+            return
+
         # Read tissue file or set to one
-        if tissuefile == "":
+        # (text files are parsed once, then loaded from a binary cache)
+        if isinstance(tissuefile, str) and tissuefile == "":
             self.tissuemask = np.ones([self.m, self.n])
         else:
-            # Check for .csv or .tis extension, if not add ".tis"
-            filename = os.path.join("data",tissuefile)
-            if not (".tis" in filename) and \
-               not (".csv" in filename):
-                filename += ".tis"
-
-            # Read lines from tissuefile
-            f = open(filename,"r")
-            lines= f.readlines()
-            f.close()
-            print("Reading "+filename)
-            
-            # Read tissue data from lines from tissue CSV file
-            # Use list for appending
-            tissuelist = []
-            for line in lines:
-                if line.strip()[0]=="#":
-                    continue # Comment line skip to next
-                else:
-                    row = []
-                    columns = line.split(",")
-                    for col in columns:
-                        row.append(float(col))
-
-                # Add row of data
-                tissuelist.append(row)
-
-            # Convert list to numpy array
-            # Row,column  = x,y so transpose data from file
-            self.tissuemask = np.array(tissuelist).T
-        
+            self.tissuemask = loadtissue(tissuefile, self.m, self.n)
 
         #if tissuesimulation:
         #    tissuemask[int(m / 3):2 * int(m / 3), int(n / 3):2 * int(n / 3)] = .1
@@ -107,6 +137,35 @@ class Model():
         #    print("Simulated tissue:", tissuemask)
 
 
+    def setsequence(self, sequence, dt, tstart=0.):
+        '''
+        Runs a pulse sequence from simulated time tstart, sampled with time
+        step dt. None stops the sequence.
+        '''
+        self.sequence = sequence
+        self.seqstart = tstart
+        if sequence is not None:
+            sequence.compile(dt)
+
+    def sequencestep(self, t):
+        '''
+        Takes the B1 drive and the B0/B1 switches at time t from the pulse
+        sequence, ends the sequence after its last step.
+        '''
+        k = self.sequence.index(t - self.seqstart)
+        if k is None:
+            self.sequence = None
+            return
+
+        # NaN in the sequence: the model's own setting
+        b1mag, b1freq = self.sequence.b1mag[k], self.sequence.b1freq[k]
+        if np.isnan(b1mag):
+            b1mag = self.b1mag
+        if np.isnan(b1freq):
+            b1freq = self.b1freq
+        self.pulse = (b1mag, b1freq, self.sequence.phase[k])
+        self.b0on, self.b1on = self.sequence.b0on[k], self.sequence.b1on[k]
+
     def force(self, bx, by, theta):
         # Force function
         '''
@@ -129,32 +188,63 @@ class Model():
         force = forcemag * np.sin(anglediff)
         return force
 
-    def update(self, tsim, dt):
+    def acceleration(self, tsim, theta, v):
         '''
-        Time integration from acceleration, to velocity, to theta.
+        Angular acceleration of the arrows at time tsim for angles theta
+        and angular velocities v.
         '''
-        # Model update function
-        if dt > 0.:
-            # Update magnetic field arrays, separate for x and y (B0 and B1)
-            self.b0 = self.b0mag * self.b0gradient
+        # Update magnetic field arrays, separate for x and y (B0 and B1)
+        self.b0 = self.b0mag * self.b0gradient
+        if self.sequence is None:
             self.b1 = self.b1mag * np.cos(2 * np.pi * self.b1freq * tsim) * self.b1gradient
-            a = self.tissuemask * self.force(self.b0on * self.b0, self.b1on * self.b1, self.theta)\
-                   - self.kdamper * self.v
+        else:
+            # Pulse of the sequence for this time step
+            b1mag, b1freq, phase = self.pulse
+            self.b1 = b1mag * np.cos(2 * np.pi * b1freq * tsim + phase) * self.b1gradient
+        bx, by = self.b0on * self.b0, self.b1on * self.b1
 
-            # can add a factor here if necessary to simulate MoI
+        # Optional field of the other arrows
+        if self.kcoupling != 0.:
+            dipolex, dipoley = dipolefield(theta)
+            bx = bx + self.kcoupling * dipolex
+            by = by + self.kcoupling * dipoley
 
-            self.v = self.v + a * dt
-            self.theta = self.theta + self.v * dt
+        a = self.tissuemask * self.force(bx, by, theta) - self.kdamper * v
 
-            # Now all array calculations are done
-            # We have to switch to loops/lists for graphics
+        # can add a factor here if necessary to simulate MoI
+        return a
 
-            # Set all arrows from arrowlist to their new angle
-            for i in range(self.m):
-                for j in range(self.n):
-                    # Update the arrow for this iteration
-                    # Slicing looks different because arrowlist a nested list
-                    self.arrowlist[i][j].update(self.theta[i, j])
+    def update(self, tsim, dt):
+        '''
+        Time integration from acceleration, to velocity, to theta,
+        over the time step dt ending at tsim.
+        '''
+        # Model update function
+        if dt > 0.:
+            # Pulse sequence values at the start of the step
+            if self.sequence is not None:
+                self.sequencestep(tsim - dt)
 
+            integrate = integrators[self.integrator]
+            self.theta, self.v = integrate(self.acceleration, tsim - dt, dt,
+                                           self.theta, self.v)
 
+    def run(self, tsim, dt, nsteps):
+        '''
+        Headless loop: steps the model nsteps times with a fixed dt,
+        without any display or sprite work. Returns the new simulated time.
+        '''
+        for k in range(nsteps):
+            tsim = tsim + dt
+            self.update(tsim, dt)
+        return tsim
 
+
+def combinations(b0list, b1list, f1list, tissuelist=("",)):
+    '''
+    All combinations of the given B0 magnitudes, B1 magnitudes, B1 frequencies
+    and tissue files, as four equal length lists for a batch mode Model.
+    '''
+    combis = list(itertools.product(b0list, b1list, f1list, tissuelist))
+    b0s, b1s, f1s, tissues = [list(setting) for setting in zip(*combis)]
+    return b0s, b1s, f1s, tissues
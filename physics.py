@@ -0,0 +1,129 @@
+"""
+Physics on a worker thread: the model is stepped at a fixed time step,
+following the wall clock, and every batch of steps is published as a
+snapshot (theta and the field settings) for the main thread to draw.
+Two snapshot buffers are used: the thread fills the back one while the
+main thread draws the front one, then they are swapped. Key inputs go to
+the thread through a queue.SimpleQueue, where putting never waits.
+NumPy releases the GIL in large array operations, so on big grids the
+physics keeps its rate while the screen is drawn.
+"""
+import time
+import queue
+import threading
+import numpy as np
+
+
+class Snapshot():
+    '''State of the model for drawing a frame.'''
+    def __init__(self, model):
+        self.theta = model.theta.copy()
+        self.fill(model, 0.)
+        self.count = 0
+
+    def fill(self, model, tsim):
+        '''Copies the current state of the model into this snapshot.'''
+        np.copyto(self.theta, model.theta)
+        self.tsim = tsim
+        self.b0mag, self.b1mag, self.b1freq = model.b0mag, model.b1mag, model.b1freq
+        self.b0on, self.b1on = model.b0on, model.b1on
+
+
+class Physicsthread():
+    '''
+    Steps model (and adds the plot data to plotter) every dt seconds of
+    wall clock time, at most maxdt behind: when the thread can't keep up,
+    like a slow PC in the serial loop, the simulation slows down.
+    applykeys(model, plotter, keys, dt, tsim, t) handles the key inputs.
+    '''
+    def __init__(self, model, plotter, dt, applykeys, maxdt=0.1):
+        self.model = model
+        self.plotter = plotter
+        self.dt = dt
+        self.applykeys = applykeys
+        self.maxsteps = max(1, int(maxdt / dt))
+        self.tsim = 0.
+
+        # Front snapshot is drawn, back one filled, lock only for the swap
+        self.snapshots = [Snapshot(model), Snapshot(model)]
+        self.front = 0
+        self.lock = threading.Lock()
+
+        # Key inputs (keys, frame dt, wall clock time) from the main thread
+        self.inputs = queue.SimpleQueue()
+
+        self.running = False
+        self.error = None
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def start(self):
+        '''Starts stepping the model.'''
+        self.running = True
+        self.thread.start()
+
+    def send(self, keys, dt, t):
+        '''Passes keys pressed during a frame of dt seconds to the physics.'''
+        self.inputs.put((keys, dt, t))
+
+    def latest(self):
+        '''
+        The newest snapshot. Only use it while holding lock, otherwise the
+        thread may fill it again.
+        '''
+        return self.snapshots[self.front]
+
+    def publish(self, count):
+        '''Fills the back snapshot and swaps it to the front.'''
+        back = self.snapshots[1 - self.front]
+        back.fill(self.model, self.tsim)
+        back.count = count
+
+        # Skipped while the main thread draws, the next publish is newer
+        if self.lock.acquire(blocking=False):
+            self.front = 1 - self.front
+            self.lock.release()
+
+    def loop(self):
+        '''Thread: handles inputs, steps the model, publishes snapshots.'''
+        try:
+            tstart = time.perf_counter()
+            nstep = 0
+            while self.running:
+                # Key inputs in the order they came
+                while True:
+                    try:
+                        keys, framedt, t = self.inputs.get_nowait()
+                    except queue.Empty:
+                        break
+                    self.applykeys(self.model, self.plotter, keys, framedt, self.tsim, t)
+
+                # Steps to catch up with the wall clock
+                behind = int((time.perf_counter() - tstart) / self.dt) - nstep
+                if behind > self.maxsteps:
+                    nstep += behind - self.maxsteps
+                    behind = self.maxsteps
+                if behind <= 0:
+                    time.sleep(self.dt / 4)
+                    continue
+
+                for k in range(behind):
+                    self.plotter.tableupdate(self.tsim, self.model.b0on*self.model.b0mag,
+                                             self.model.theta,
+                                             self.model.b1on*self.model.b1freq,
+                                             self.model.b1mag, self.model.b0on,
+                                             self.model.b1on)
+                    self.tsim = self.tsim + self.dt
+                    self.model.update(self.tsim, self.dt)
+                nstep += behind
+                self.publish(nstep)
+        except Exception as error:
+            # Handed to the main thread by stop()
+            self.error = error
+            self.running = False
+
+    def stop(self):
+        '''Stops the thread, raises an error of the thread here.'''
+        self.running = False
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
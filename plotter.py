@@ -1,8 +1,79 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from recorder import Recorder
+from liveplot import Liveplot
 
 # Show plot at end of program to help in finding reso frequency
 
+class Timeseries():
+    '''
+    Preallocated NumPy storage for samples of a fixed shape (e.g. a scalar,
+    or all thetas), so no Python lists grow with every sample.
+    Without a capacity the buffer doubles when full. With a capacity it is
+    a ring buffer that keeps only the last capacity samples: every sample is
+    stored twice, so the samples in time order are always one contiguous
+    view and data() never copies.
+    '''
+    def __init__(self, shape=(), chunk=1024, capacity=None):
+        self.shape = tuple(shape)
+        self.capacity = capacity
+        self.count = 0 # number of samples stored
+        self.start = 0 # index of the oldest sample in ring mode
+        if capacity is None:
+            self.buffer = np.empty((chunk,) + self.shape)
+        else:
+            self.buffer = np.empty((2 * capacity,) + self.shape)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        '''Adds one sample, in ring mode overwriting the oldest when full.'''
+        if self.capacity is None:
+            # Grow, doubling the size, when the buffer is full
+            if self.count == len(self.buffer):
+                newbuffer = np.empty((2 * len(self.buffer),) + self.shape)
+                newbuffer[:self.count] = self.buffer
+                self.buffer = newbuffer
+            self.buffer[self.count] = value
+            self.count += 1
+        else:
+            # Store at the ring position and in the second half
+            if self.count < self.capacity:
+                i = (self.start + self.count) % self.capacity
+                self.count += 1
+            else:
+                i = self.start
+                self.start = (self.start + 1) % self.capacity
+            self.buffer[i] = value
+            self.buffer[i + self.capacity] = value
+
+    def data(self):
+        '''All stored samples in time order, a view on the buffer.'''
+        return self.buffer[self.start:self.start + self.count]
+
+    def setdata(self, values):
+        '''Replaces all stored samples by values (in time order).'''
+        self.start, self.count = 0, 0
+        if self.capacity is not None:
+            values = values[-self.capacity:]
+        elif len(values) > len(self.buffer):
+            self.buffer = np.empty((len(values),) + self.shape)
+        self.count = len(values)
+        self.buffer[:self.count] = values
+        if self.capacity is not None:
+            self.buffer[self.capacity:self.capacity + self.count] = values
+
+    def decimate(self, factor, keeplast=0):
+        '''
+        Keeps only every factor-th sample, except for the last keeplast
+        samples, to reduce the memory used by older data.
+        '''
+        values = self.data()
+        nold = max(self.count - keeplast, 0)
+        self.setdata(np.concatenate([values[:nold:factor], values[nold:]]))
+
+
 class Plotter():
     '''
     Handles everything necessary to create graphs after the simulation is done,
@@ -10,21 +81,64 @@ class Plotter():
     Tracks and later displays B0 magnitude, B1 freq, and theta through time.
     B1 magnitude isn't tracked, since its only requirement for finding the
     resonance frequency is being strong enough, not a specific value.
+    The tables are Timeseries: with a capacity only the last capacity
+    samples are kept, so memory stays bounded on long runs.
+    For large grids theta is kept for at most maxthetas arrows, evenly
+    spread over the grid (the std dev still uses all arrows).
     '''
-    def __init__(self,tsim,dtplot):
+    def __init__(self,tsim,dtplot,capacity=None,maxthetas=100):
         # Store starting time for plotting timer
         self.dtplot = dtplot
         self.tplot = tsim
 
         # Tabular data for plotting and timing
-        self.thetatab = []
-        self.b0tab = []
-        self.f1tab = []
-        self.timetab = []
-        self.devtab = []
+        # thetatab is made at the first sample, when the grid size is known
+        self.capacity = capacity
+        self.maxthetas = maxthetas
+        self.thetatab = None
+        self.b0tab = Timeseries(capacity=capacity)
+        self.f1tab = Timeseries(capacity=capacity)
+        self.timetab = Timeseries(capacity=capacity)
+        self.devtab = Timeseries(capacity=capacity)
         self.treset = []
 
-    def tableupdate(self,tsim,b0mag,theta,b1freq):
+        # Optional streaming of all samples to disk, see startrecording
+        self.recorder = None
+
+        # Optional live plots during the run, see startliveplot
+        self.liveplot = None
+
+    def startliveplot(self,interval=0.2,maxpoints=1000):
+        '''
+        Shows live plots of the samples in a separate process while
+        the simulation runs, updated every interval seconds.
+        '''
+        self.liveplot = Liveplot(interval,maxpoints)
+
+    def stopliveplot(self):
+        '''Closes the live plots.'''
+        if self.liveplot is not None:
+            self.liveplot.close()
+            self.liveplot = None
+
+    def startrecording(self,dirname,chunk=100):
+        '''
+        Streams every sample also to chunked files in folder dirname,
+        written in the background, so data survives a crash and long runs
+        do not need to be kept in memory. Read back with readrecording().
+        '''
+        self.recorder = Recorder(dirname,chunk)
+
+    def stoprecording(self):
+        '''
+        Writes the last samples and closes the recording, raises a write
+        error of the recording (also then the recording is stopped).
+        '''
+        if self.recorder is not None:
+            recorder, self.recorder = self.recorder, None
+            recorder.close()
+
+    def tableupdate(self,tsim,b0mag,theta,b1freq,b1mag=np.nan,b0on=True,b1on=True):
         '''
         Adds a new data point in each plot if the time since last update is
         longer than dtplot, the time steps of the plots. Saving data on every
@@ -43,10 +157,33 @@ class Plotter():
             m,n = theta.shape
             allthetas = theta.reshape(m * n)
 
-            self.thetatab.append(np.mod(allthetas,360))
+            # Every thetastep-th arrow for the theta plot
+            if self.thetatab is None:
+                self.thetastep = max(1, (m * n) // self.maxthetas)
+                ntheta = len(allthetas[::self.thetastep])
+                self.thetatab = Timeseries((ntheta,), capacity=self.capacity)
+            self.thetatab.append(np.mod(allthetas[::self.thetastep],360))
             self.devtab.append(np.std(allthetas))
             self.f1tab.append(b1freq)
 
+            # Same sample to disk when recording
+            if self.recorder is not None:
+                self.recorder.add(tsim, b0mag, b1mag, b1freq, b0on, b1on,
+                                  self.devtab.data()[-1], allthetas)
+
+            # And to the live plots
+            if self.liveplot is not None:
+                self.liveplot.add(tsim, b0mag, b1freq, self.devtab.data()[-1], allthetas)
+
+    def decimate(self,factor,keeplast=0):
+        '''
+        Keeps only every factor-th sample of all tables, except for the last
+        keeplast samples, to save memory on long runs.
+        '''
+        for table in (self.timetab, self.b0tab, self.f1tab, self.devtab, self.thetatab):
+            if table is not None:
+                table.decimate(factor, keeplast)
+
     def tabletreset(self,tsim):
         '''Tracks RESET button usage'''
         # Save the times of resetting arrows for red lines in the plot
@@ -57,25 +194,33 @@ class Plotter():
         Draws the saved data (B0 magnitude, B1 frequency and theta) in 3 plots.
         '''
 
+        # Nothing to plot before the first sample
+        if len(self.timetab) == 0:
+            return
+
         # Three or four rows with a plot, increase this number to add a plot
         nrows = 3
 
+        # Views on the stored data, no copies
+        timetab = self.timetab.data()
+        thetatab = self.thetatab.data()
+
         # Plot data
         plt.subplot(nrows*100+11)
         plt.title("B0 field")
-        plt.plot(self.timetab, self.b0tab)
+        plt.plot(timetab, self.b0tab.data())
         
         plt.subplot(nrows*100+12)
         plt.title("B1 freq [Hz]")
-        plt.plot(self.timetab, self.f1tab)
+        plt.plot(timetab, self.f1tab.data())
         
         plt.subplot(nrows*100+13)
         plt.title("Theta")
-        plt.vlines(self.treset, np.min(self.thetatab), np.max(self.thetatab), "r")
-        plt.plot(self.timetab, self.thetatab)
+        plt.vlines(self.treset, np.min(thetatab), np.max(thetatab), "r")
+        plt.plot(timetab, thetatab)
         
 #        plt.subplot(nrows*100+14)
 #        plt.title("Std Dev Theta")
-#        plt.plot(self.timetab, self.devtab)
+#        plt.plot(timetab, self.devtab.data())
 
         plt.show()
@@ -0,0 +1,105 @@
+"""
+Frame profiler for the simulation loop in sim.py: times every phase of each
+frame (table update, model update, drawing, keys), keeps rolling percentiles
+over the last frames for a HUD on the screen and a summary at the end, and
+can export all phases as a Chrome trace (open in chrome://tracing or
+ui.perfetto.dev). When not profiling sim.py makes no Profiler at all.
+"""
+import json
+import time
+import numpy as np
+
+# Phases of a frame, in loop order, and the short names for the HUD
+phases = ["tableupdate", "model.update", "clearscreen", "textpanel",
+          "drawarrows", "hud", "updatescreen", "getkeys"]
+shortnames = ["table", "model", "clear", "text", "arrows", "hud", "screen", "keys"]
+
+
+class Profiler():
+    '''
+    Call startframe() at the start of a frame, mark(phase) right after each
+    phase and endframe() at the end. A phase lasts from the previous mark
+    (or the frame start), phases run more than once in a frame are added.
+    The last window frames are kept for the percentiles, at most maxevents
+    phases for the trace.
+    '''
+    def __init__(self, window=300, maxevents=200000, hudinterval=0.5):
+        self.window = window
+        self.maxevents = maxevents
+        self.hudinterval = hudinterval
+        self.index = {phase: k for k, phase in enumerate(phases)}
+
+        # Seconds per phase for the last frames, last column the whole frame
+        self.times = np.zeros((window, len(phases) + 1))
+        self.frame = np.zeros(len(phases))
+        self.nframes = 0
+
+        # Trace events (name, start, duration), in seconds from tstart
+        self.events = []
+        self.tstart = time.perf_counter()
+        self.tframe = self.tlast = self.tstart
+
+        # HUD text, only made again every hudinterval seconds
+        self.hudtext = []
+        self.thud = -hudinterval
+
+    def startframe(self):
+        '''Starts timing a new frame.'''
+        self.tframe = self.tlast = time.perf_counter()
+        self.frame[:] = 0.
+
+    def mark(self, phase):
+        '''Ends phase: adds the time since the last mark to it.'''
+        t = time.perf_counter()
+        self.frame[self.index[phase]] += t - self.tlast
+        if len(self.events) < self.maxevents:
+            self.events.append((phase, self.tlast - self.tstart, t - self.tlast))
+        self.tlast = t
+
+    def endframe(self):
+        '''Stores the phase times of this frame in the rolling window.'''
+        t = time.perf_counter()
+        row = self.nframes % self.window
+        self.times[row, :-1] = self.frame
+        self.times[row, -1] = t - self.tframe
+        self.nframes += 1
+        if len(self.events) < self.maxevents:
+            self.events.append(("frame", self.tframe - self.tstart, t - self.tframe))
+
+    def percentiles(self, q=(50, 95, 99)):
+        '''
+        Percentiles [ms] of every phase and of the whole frame ("frame")
+        over the last window frames, as a dictionary of arrays.
+        '''
+        if self.nframes == 0:
+            return {}
+        times = self.times[:min(self.nframes, self.window)]
+        values = np.percentile(times, q, axis=0).T * 1000.
+        return dict(zip(phases + ["frame"], values))
+
+    def hudlines(self):
+        '''Lines of text with the p95 times [ms] for the HUD.'''
+        t = time.perf_counter()
+        if t - self.thud >= self.hudinterval and self.nframes > 0:
+            self.thud = t
+            p95 = self.percentiles((95,))
+            values = ["%s %.2f" % (name, p95[phase][0])
+                      for name, phase in zip(shortnames, phases)]
+            self.hudtext = ["Frame p95 %.1f ms, phases:" % p95["frame"][0],
+                            "  ".join(values[:3]), "  ".join(values[3:6]),
+                            "  ".join(values[6:])]
+        return self.hudtext
+
+    def summary(self):
+        '''Prints the percentiles of all phases.'''
+        print("%-14s %8s %8s %8s  (ms, last %d frames)" % ("phase", "p50", "p95", "p99",
+                                                         min(self.nframes, self.window)))
+        for phase, values in self.percentiles().items():
+            print("%-14s %8.3f %8.3f %8.3f" % (phase, values[0], values[1], values[2]))
+
+    def writetrace(self, filename):
+        '''Saves the timed phases as a Chrome trace JSON file.'''
+        events = [{"name": name, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6,
+                   "pid": 0, "tid": 0} for name, start, duration in self.events]
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,118 @@
+"""
+Streaming telemetry: samples are collected in chunks and written to .npz
+files in a folder by a background thread, so the simulation loop never
+waits for the disk and a crash loses at most the last unwritten chunk.
+A failed write is raised by the next add() or by close().
+"""
+import os
+import glob
+import queue
+import threading
+import numpy as np
+
+# Names of the recorded columns, theta has one value per arrow
+columns = ["tsim", "b0", "b1", "f1", "b0on", "b1on", "dev", "theta"]
+
+
+class Recorder():
+    '''
+    Records samples to chunked .npz files (chunk00000.npz, chunk00001.npz, ...)
+    in dirname. Every chunk file holds one array per column.
+    '''
+    def __init__(self, dirname, chunk=100):
+        self.dirname = dirname
+        self.chunk = chunk
+        os.makedirs(dirname, exist_ok=True)
+
+        # Start with an empty folder, old chunks would mix with the new ones
+        for fname in glob.glob(os.path.join(dirname, "chunk*.npz")):
+            os.remove(fname)
+
+        # Chunk being filled, made at the first sample when theta size is known
+        self.data = None
+        self.i = 0
+        self.nchunk = 0
+
+        # Writer thread, gets (filename, data) from the queue, None to stop,
+        # keeps the first write error for the simulation thread
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def add(self, tsim, b0, b1, f1, b0on, b1on, dev, theta):
+        '''Adds one sample, hands the chunk to the writer thread when full.'''
+        if self.error is not None:
+            raise self.error
+        if self.data is None:
+            self.data = {name: np.empty(self.chunk) for name in columns[:-1]}
+            self.data["theta"] = np.empty((self.chunk, np.size(theta)))
+
+        sample = (tsim, b0, b1, f1, b0on, b1on, dev)
+        for name, value in zip(columns, sample):
+            self.data[name][self.i] = value
+        self.data["theta"][self.i] = np.ravel(theta)
+
+        self.i += 1
+        if self.i == self.chunk:
+            self.flush()
+
+    def flush(self):
+        '''Sends the samples collected so far to the writer thread.'''
+        if self.data is not None and self.i > 0:
+            fname = os.path.join(self.dirname, "chunk%05d.npz" % self.nchunk)
+            chunkdata = {name: values[:self.i] for name, values in self.data.items()}
+            self.queue.put((fname, chunkdata))
+            self.nchunk += 1
+
+        # New arrays, the old ones now belong to the writer
+        self.data = None
+        self.i = 0
+
+    def writer(self):
+        '''
+        Background thread: writes chunks until it gets None. After an error
+        it keeps taking chunks from the queue, so close() doesn't wait forever.
+        '''
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            fname, chunkdata = item
+
+            # Write to a temporary file first, so a chunk file is always complete
+            try:
+                with open(fname + ".tmp", "wb") as f:
+                    np.savez(f, **chunkdata)
+                os.replace(fname + ".tmp", fname)
+            except Exception as error:
+                # Handed to the simulation by add() and close()
+                if self.error is None:
+                    self.error = error
+
+    def close(self):
+        '''
+        Writes the remaining samples and waits for the writer to finish.
+        Raises the first write error of the writer here.
+        '''
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def readrecording(dirname):
+    '''
+    Reads all chunks of a recording, returns a dictionary with
+    one array per column (theta: one row per sample).
+    '''
+    fnames = sorted(glob.glob(os.path.join(dirname, "chunk*.npz")))
+    if len(fnames) == 0:
+        return {}
+    data = {name: [] for name in columns}
+    for fname in fnames:
+        with np.load(fname) as chunk:
+            for name in columns:
+                data[name].append(chunk[name])
+    return {name: np.concatenate(values) for name, values in data.items()}
@@ -0,0 +1,84 @@
+"""
+Analytic resonance prediction, without time stepping.
+Around the rest position (theta = 180 deg, against B0) each arrow is a damped
+harmonic oscillator for small angles:
+
+    theta'' + kdamper theta' + w0^2 theta = tissuemask b1 cos(2 pi f1 t)
+
+with w0^2 = tissuemask b0mag b0gradient pi/180 (theta in degrees).
+All functions take a Model (also in batch mode) and work on whole arrays,
+so screening a parameter space costs O(m n) per setting. Only valid for
+small angles: use the time domain simulation for the candidates found here.
+"""
+import numpy as np
+
+
+def centerfreq(b0mag):
+    '''
+    Undamped natural frequency [Hz] of an arrow with tissue factor 1 and
+    B0 gradient 1 in B0 b0mag, or in the field b0mag of each arrow.
+    '''
+    return np.sqrt(b0mag * np.pi / 180) / (2 * np.pi)
+
+
+def naturalfreq(model):
+    '''Undamped natural frequency [Hz] of every arrow.'''
+    return centerfreq(model.b0on * model.tissuemask * model.b0mag * model.b0gradient)
+
+
+def resonancefreq(model):
+    '''
+    Frequency [Hz] of the largest steady state amplitude of every arrow,
+    shifted down from the natural frequency by the damping. NaN when the
+    damping is too strong for a resonance peak.
+    '''
+    w02 = (2 * np.pi * naturalfreq(model)) ** 2
+    wr2 = w02 - model.kdamper ** 2 / 2
+    return np.sqrt(np.where(wr2 > 0, wr2, np.nan)) / (2 * np.pi)
+
+
+def amplitude(model, f1=None):
+    '''
+    Steady state amplitude [deg] of every arrow under the B1 drive,
+    at the model's B1 frequency or at the given frequency f1 [Hz].
+    f1 may also be an array of frequencies with a shape that broadcasts.
+    '''
+    if f1 is None:
+        f1 = model.b1freq
+    w = 2 * np.pi * np.asarray(f1, dtype=float)
+    w02 = (2 * np.pi * naturalfreq(model)) ** 2
+
+    # Drive: B1 perpendicular to B0 adds tissuemask * b1 to the acceleration
+    drive = model.b1on * model.tissuemask * model.b1mag * model.b1gradient
+    return np.abs(drive) / np.sqrt((w02 - w ** 2) ** 2 + (model.kdamper * w) ** 2)
+
+
+def response(model, f1list):
+    '''
+    Amplitudes for a list of B1 frequencies in one go.
+    Returns an array with the frequencies on the first axis.
+    '''
+    f1s = np.asarray(f1list, dtype=float).reshape((-1,) + (1,) * np.ndim(model.theta))
+    return amplitude(model, f1s)
+
+
+def resonancemap(model):
+    '''
+    Predicted resonance map of the grid: resonance frequency [Hz], quality
+    factor and amplitude [deg] at the current B1 frequency of every arrow.
+    '''
+    w0 = 2 * np.pi * naturalfreq(model)
+    qfactor = w0 / model.kdamper
+    return resonancefreq(model), qfactor, amplitude(model)
+
+
+def candidates(model, f1list, fraction=0.5):
+    '''
+    Screens the frequencies: returns those for which the mean predicted
+    amplitude over the grid is at least fraction of the highest one.
+    These are worth a time domain simulation (see sweep.py).
+    '''
+    f1s = np.asarray(f1list, dtype=float)
+    amps = response(model, f1s)
+    meanamps = amps.reshape(len(f1s), -1).mean(axis=1)
+    return f1s[meanamps >= fraction * np.max(meanamps)]
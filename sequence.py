@@ -0,0 +1,173 @@
+"""
+Pulse sequences: timed segments of B1 amplitude, frequency, phase and
+on/off gating of B0 and B1, compiled once into arrays with one value per
+time step, so the model only looks up an index every step.
+Standard sequences (90/180 degree pulses, spin echo, inversion recovery)
+are made with the functions below. Run one with Model.setsequence, or
+sim.main(sequence=...) and sweep(sequence=...), for example:
+
+    from sequence import spinecho
+    sim.main(sequence=spinecho(4000, 3000, te=10., tr=30.), fixeddt=0.01)
+
+The arrows are damped pendulums, not spins: pulse lengths are found by
+simulating the swing of an arrow with tissue factor 1 (a 180 degree pulse
+needs a strong B1, about 3000 for B0 4000), and a 180 degree pulse does
+not refocus the arrows as it does spins, so there is hardly an echo.
+"""
+import numpy as np
+from model import Model
+from resonance import centerfreq
+
+
+class Segment():
+    '''
+    Part of a sequence: for duration seconds B1 with amplitude b1mag,
+    frequency b1freq [Hz] and phase [deg], B1 and B0 switched on or off by
+    b1on and b0on. b1mag or b1freq None keeps the model's own value.
+    '''
+    def __init__(self, duration, b1mag=None, b1freq=None, phase=0., b1on=True, b0on=True):
+        self.duration = duration
+        self.b1mag, self.b1freq, self.phase = b1mag, b1freq, phase
+        self.b1on, self.b0on = b1on, b0on
+
+
+class Sequence():
+    '''
+    List of segments, run once or repeated. compile(dt) makes the arrays
+    b1mag, b1freq (NaN for the model's own value), phase [rad], b1on and
+    b0on, with one value per time step dt.
+    '''
+    def __init__(self, segments, repeat=False):
+        self.segments = segments
+        self.repeat = repeat
+        self.duration = sum([segment.duration for segment in segments])
+        self.dt = None
+
+    def compile(self, dt):
+        '''Samples the segments every dt seconds, done once per dt.'''
+        if self.dt == dt:
+            return
+        self.dt = dt
+
+        # Number of steps per segment, at least one
+        counts = [max(1, int(round(segment.duration / dt))) for segment in self.segments]
+        def sample(values):
+            return np.repeat(np.array(values, dtype=float), counts)
+
+        self.b1mag = sample([np.nan if s.b1mag is None else s.b1mag for s in self.segments])
+        self.b1freq = sample([np.nan if s.b1freq is None else s.b1freq for s in self.segments])
+        self.phase = np.radians(sample([s.phase for s in self.segments]))
+        self.b1on = sample([s.b1on for s in self.segments]).astype(bool)
+        self.b0on = sample([s.b0on for s in self.segments]).astype(bool)
+        self.nsteps = len(self.b1mag)
+
+    def index(self, t):
+        '''
+        Index in the arrays at t seconds after the start,
+        None when a sequence that is not repeated has ended.
+        '''
+        # Small margin against rounding of the sum of the time steps
+        k = int(t / self.dt + 1e-6)
+        if k >= self.nsteps:
+            if not self.repeat:
+                return None
+            k = k % self.nsteps
+        return k
+
+
+def compiled(dt, b1mag, b1freq, phase, b1on, b0on, repeat=False):
+    '''
+    Sequence from the arrays of Sequence.compile at time step dt, as
+    stored in a session log, without its segments.
+    '''
+    sequence = Sequence([], repeat)
+    sequence.dt = dt
+    sequence.b1mag, sequence.b1freq, sequence.phase = b1mag, b1freq, phase
+    sequence.b1on, sequence.b0on = b1on.astype(bool), b0on.astype(bool)
+    sequence.nsteps = len(b1mag)
+    sequence.duration = sequence.nsteps * dt
+    return sequence
+
+
+def pulse(angle, b0mag, b1mag, phase=0., kdamper=0.6):
+    '''
+    Segment with B1 at the centre frequency for B0 b0mag, long enough to
+    make the arrows (tissue factor 1, at rest) swing angle degrees.
+    Raises a ValueError when b1mag is too weak for the angle.
+    '''
+    f0 = centerfreq(b0mag)
+    return Segment(pulselength(angle, b0mag, b1mag, f0, kdamper), b1mag, f0, phase)
+
+
+def pulselength(angle, b0mag, b1mag, f1, kdamper):
+    '''
+    Time [s] B1 at f1 takes to make one arrow swing angle degrees from rest.
+    Simulated with the model, as the linear estimate fails for large swings:
+    those are slower than f1, fall behind the drive and stop growing.
+    The swing is the angle at which the energy of the arrow is all potential.
+    Raises a ValueError when the swing stays below angle.
+    '''
+    # One arrow without noise, steps of 1/50 period
+    model = Model(b0mag, b1mag, f1, 1, 1, integrator="rk4")
+    model.b0gradient = np.ones((1, 1))
+    model.kdamper = kdamper
+    w02 = b0mag * np.pi / 180
+    dt = 1. / (50 * f1)
+
+    # For at most 5 damping times, the swing doesn't grow after that
+    tsim, swing, maxswing = 0., 0., 0.
+    while tsim < 10. / kdamper:
+        tsim = model.run(tsim, dt, 1)
+        previous = swing
+        energy = 0.5 * np.radians(model.v[0, 0]) ** 2 + \
+                 w02 * (1 - np.cos(np.radians(model.theta[0, 0] - 180)))
+        swing = np.degrees(np.arccos(max(-1., 1 - energy / w02)))
+        maxswing = max(maxswing, swing)
+        if swing >= angle:
+            # Time within the last step at which angle was reached
+            return tsim - dt * (swing - angle) / (swing - previous)
+    raise ValueError("B1 too weak for a %g degree pulse, at most %.0f degrees" %
+                     (angle, maxswing))
+
+
+def delay(duration):
+    '''Segment without B1.'''
+    return Segment(duration, b1on=False)
+
+
+def spinecho(b0mag, b1mag, te, tr=None, repeat=False):
+    '''
+    Spin echo: 90 degree pulse, 180 degree pulse (phase 90) at te/2 and
+    the echo at te, times from the middle of the 90 degree pulse.
+    With tr the sequence lasts tr seconds, for repeating it.
+    '''
+    p90 = pulse(90., b0mag, b1mag)
+    p180 = pulse(180., b0mag, b1mag, phase=90.)
+    segments = [p90, delay(te / 2 - p90.duration / 2 - p180.duration / 2),
+                p180, delay(te / 2 - p180.duration / 2)]
+    return timed(segments, p90.duration / 2 + te, tr, repeat)
+
+
+def inversionrecovery(b0mag, b1mag, ti, tr=None, repeat=False):
+    '''
+    Inversion recovery: 180 degree pulse, then after the inversion time ti
+    a 90 degree pulse, times between the middles of the pulses.
+    With tr the sequence lasts tr seconds, for repeating it.
+    '''
+    p180 = pulse(180., b0mag, b1mag)
+    p90 = pulse(90., b0mag, b1mag)
+    segments = [p180, delay(ti - p180.duration / 2 - p90.duration / 2), p90]
+    return timed(segments, p180.duration / 2 + ti + p90.duration / 2, tr, repeat)
+
+
+def timed(segments, tend, tr, repeat):
+    '''
+    Sequence of segments, filled up with a delay to tr when given.
+    Raises a ValueError when the times are too short for the pulses.
+    '''
+    if tr is not None:
+        segments.append(delay(tr - tend))
+    for segment in segments:
+        if segment.duration < 0:
+            raise ValueError("Sequence times too short for the pulses")
+    return Sequence(segments, repeat)
@@ -0,0 +1,96 @@
+"""
+Session logs for record and replay: the settings and noise seed of a run,
+the time step and number of physics steps of every frame and the keys
+pressed in it, saved in one compressed .npz file. A pulse sequence is
+saved as compiled, so its time steps are the same. Replaying these frames
+(sim.main with replayfile) repeats the run exactly, also without a display.
+"""
+import numpy as np
+from sequence import compiled
+
+# Key actions of GUI.getkeys, bit k of a key mask is keynames[k]
+keynames = ["RIGHT", "LEFT", "UP", "DOWN", "PLUS", "MINUS", "V", "B",
+            "ESC", "RESET", "B0", "B1"]
+
+# Settings of sim.main stored in a session log
+settingnames = ["b0set", "b1set", "f1set", "tissuefile", "m", "n",
+                "seed", "integrator", "kcoupling"]
+
+# Arrays of a compiled pulse sequence stored in a session log
+sequencenames = ["b1mag", "b1freq", "phase", "b1on", "b0on"]
+
+
+class Sessionlog():
+    '''
+    Collects the frames of a run. Frames without time step and keys change
+    nothing and are left out. Only frames with keys store a key mask.
+    settings has the settingnames and "sequence", the pulse sequence or None.
+    '''
+    def __init__(self, settings):
+        self.settings = settings
+        self.dts = []
+        self.nsteps = []
+        self.keyframes = []
+        self.keymasks = []
+
+    def add(self, dt, nsteps, keys):
+        '''Adds a frame: nsteps physics steps of dt, then the keys.'''
+        if dt == 0. and len(keys) == 0:
+            return
+        if len(keys) > 0:
+            mask = 0
+            for key in keys:
+                mask |= 1 << keynames.index(key)
+            self.keyframes.append(len(self.dts))
+            self.keymasks.append(mask)
+        self.dts.append(dt)
+        self.nsteps.append(nsteps)
+
+    def save(self, filename, theta):
+        '''
+        Saves the log, with the final theta to check a replay against.
+        '''
+        # Pulse sequence arrays at the time step the run compiled them at
+        arrays = {}
+        sequence = self.settings.get("sequence")
+        if sequence is not None:
+            arrays = {"sequence" + name: getattr(sequence, name) for name in sequencenames}
+            arrays["sequencedt"] = sequence.dt
+            arrays["sequencerepeat"] = sequence.repeat
+
+        np.savez_compressed(filename, dts=np.array(self.dts),
+                            nsteps=np.array(self.nsteps, dtype=np.int32),
+                            keyframes=np.array(self.keyframes, dtype=np.int32),
+                            keymasks=np.array(self.keymasks, dtype=np.uint16),
+                            thetaend=theta,
+                            **{name: np.asarray(self.settings[name]) for name in settingnames},
+                            **arrays)
+
+
+def readsession(filename):
+    '''
+    Reads a session log. Returns the settings (dictionary, with "sequence"
+    the pulse sequence or None), the frames as a list of (dt, nsteps, keys)
+    and the final theta of the recorded run.
+    '''
+    with np.load(filename) as log:
+        settings = {name: log[name][()] for name in settingnames}
+
+        # Plain Python values, so the model does the same as in the recording
+        for name in settingnames:
+            if isinstance(settings[name], np.generic):
+                settings[name] = settings[name].item()
+
+        # Compiled pulse sequence, logs without one have no sequence arrays
+        settings["sequence"] = None
+        if "sequencedt" in log.files:
+            settings["sequence"] = compiled(log["sequencedt"].item(),
+                                            *[log["sequence" + name] for name in sequencenames],
+                                            repeat=log["sequencerepeat"].item())
+
+        keys = [[] for dt in log["dts"]]
+        for frame, mask in zip(log["keyframes"], log["keymasks"]):
+            keys[frame] = [name for k, name in enumerate(keynames) if mask & (1 << k)]
+        frames = list(zip(log["dts"].tolist(), log["nsteps"].tolist(), keys))
+        thetaend = log["thetaend"]
+    return settings, frames, thetaend
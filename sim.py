@@ -7,132 +7,385 @@ import numpy as np
 from graphics import GUI, clock
 from model import Model
 from plotter import Plotter
+from profiler import Profiler
+from session import Sessionlog, readsession
+from physics import Physicsthread
 
 
-def main(b0set = 4000, b1set = 1000, f1set = 1, tissuefile=""):
-    '''Main function containing simulation loop'''
+# factor for speed of control by keys and mouse
+adjustfactor =  np.sqrt(2) # Doubling in 2 seconds. factor per second, >1 for logical behaviour
 
-    # Dimensions of compass arrow grid (m,n)
-    m, n = 5, 4
+
+def applykeys(model, plotter, keyspressed, dt, tsim, t):
+    '''
+    Changes the model for the keys pressed during a frame of dt seconds
+    (simulated time tsim, wall clock time t). Esc is handled by the loop.
+    '''
+    # B_0 magnitude with right/left
+    if 'RIGHT' in keyspressed:
+        model.b0mag *= adjustfactor**dt
+    if 'LEFT' in keyspressed:
+        model.b0mag /= adjustfactor**dt
+    
+    # B_1 magnitude with up/down
+    if 'UP' in keyspressed:
+        model.b1mag *= adjustfactor**dt
+    if 'DOWN' in keyspressed:
+        model.b1mag /= adjustfactor**dt
+
+    # Frequency (B_1) with +/-
+    if 'PLUS' in keyspressed:
+        model.b1freq *= adjustfactor**(dt*0.7)
+    if 'MINUS' in keyspressed:
+        model.b1freq /= adjustfactor**(dt*0.7)
+
+    # B_0 on/off switch
+    if "B0" in keyspressed:
+        model.b0on = not model.b0on
+
+    # B_1 on/off switch
+    if "B1" in keyspressed:
+        model.b1on = not model.b1on
+
+    # Angular velocity reset
+    if "V" in keyspressed:
+        model.v = model.v * 0#
+
+    # Total reset: angular velocity & position
+    if "RESET" in keyspressed:
+        model.v = model.v*0
+        model.theta = 140+0*model.theta
+        plotter.tabletreset(tsim) # Keep track of reset times for plots
+
+    # Magnetic fields details
+    # Debug messages
+    if "B" in keyspressed and t%.2>.18:
+        #time requirement so the message isn't printed too often
+        print("____________________\n",
+            "B0 magnitude | ", round(model.b0mag,5), "\n",
+            "B1 magnitude | ", round(model.b1mag,5), "\n",
+            "B1 frequency | ", round(model.b1freq,5),
+            "\n____________________")
+
+
+def main(b0set = 4000, b1set = 1000, f1set = 1, tissuefile="",
+         fixeddt = None, renderevery = 1, render = True, tmax = 300.,
+         seed = None, integrator = "euler", recorddir = None,
+         liveplot = False, m = 5, n = 4, view = "arrows", kcoupling = 0.,
+         profile = False, tracefile = None, recordfile = None, replayfile = None,
+         threaded = False, fps = 60, substep = 0.01, sequence = None,
+         plotcapacity = None):
+    '''
+    Main function containing simulation loop.
+    Default runs in real time: dt follows the wall clock, at fps frames per
+    second (lower when the window is not in view), with physics substeps
+    of at most substep seconds per frame.
+    With a fixeddt the simulation runs deterministic and as fast as possible:
+    every loop does renderevery physics steps of fixeddt, then draws a frame
+    (or not at all with render False) and stops when tsim passes tmax.
+    Together with a seed for the model noise this gives reproducible runs.
+    The integrator ("euler", "verlet", "rk4", "rk45") is passed to the model.
+    With a recorddir all plot samples are also streamed to files in there.
+    With a plotcapacity only the last plotcapacity plot samples (every 0.1 s)
+    are kept in memory for the plots at the end, so long runs don't fill
+    it. Without one all are kept, or with a recorddir (where all samples
+    are) the last 10000.
+    With liveplot the plots are shown and updated during the run.
+    The grid has m x n compass arrows, large grids are drawn with fewer
+    arrows, or with view "heatmap" as colours.
+    With kcoupling the arrows also feel each other's field (0 is off).
+    With profile the time of every phase of a frame is shown on the screen
+    and summarized at the end, with a tracefile also saved as Chrome trace.
+    With a recordfile the session (settings, seed, time steps and keys of
+    every frame) is logged, see session.py. With a replayfile such a log is
+    run again, as fast as possible and with the same results, headless with
+    render False. The settings then come from the log.
+    With threaded the model is stepped on a separate thread with time step
+    fixeddt (default 0.01 s) in real time, while this loop only draws and
+    reads the keys, see physics.py.
+    A pulse sequence (see sequence.py) drives B1 and switches B0 and B1
+    from the start, overruling these keys while it runs. It is recorded in
+    the session log, a replay runs the recorded sequence.
+    '''
 
     # Initialize GUI window with a caption, xmax,ymax
     xmax,ymax = 1000,800
 
+    # Replay: settings, time steps and keys from the session log
+    if replayfile is not None:
+        settings, frames, thetaend = readsession(replayfile)
+        b0set, b1set, f1set = settings["b0set"], settings["b1set"], settings["f1set"]
+        tissuefile, m, n = settings["tissuefile"], settings["m"], settings["n"]
+        seed, integrator = settings["seed"], settings["integrator"]
+        kcoupling, sequence = settings["kcoupling"], settings["sequence"]
+        iframe = 0
+
+    # Recording needs a known seed for the noise to replay the run
+    if recordfile is not None:
+        if seed is None:
+            seed = np.random.randint(2**31)
+        sessionlog = Sessionlog({"b0set": b0set, "b1set": b1set, "f1set": f1set,
+                                 "tissuefile": tissuefile, "m": m, "n": n, "seed": seed,
+                                 "integrator": integrator, "kcoupling": kcoupling,
+                                 "sequence": sequence})
+    else:
+        sessionlog = None
+
     # Create model and gui
     #model = Model(xmax,ymax,m,n)
-    gui = GUI("MRI (Magnetic Resonance Imaging) 2D simulation",xmax,ymax)
+    # No window when not rendering, only possible with a fixed time step
+    if render:
+        gui = GUI("MRI (Magnetic Resonance Imaging) 2D simulation",xmax,ymax,fps=fps)
+    elif fixeddt is None and replayfile is None:
+        raise ValueError("Running without rendering needs a fixeddt or a replayfile")
+    else:
+        gui = None
 
     # Not starting from 0 as then the unaffected arrows are quite boring
-    model = Model(b0set, b1set, f1set, m,n,xmax,ymax,tissuefile,gui)
+    model = Model(b0set, b1set, f1set, m,n,tissuefile,seed,integrator,kcoupling)
+
+    # Scripted pulse sequence, sampled at the physics time step,
+    # a replayed one is already sampled as in the recording
+    if sequence is not None:
+        if replayfile is not None:
+            model.setsequence(sequence, sequence.dt)
+        else:
+            model.setsequence(sequence, fixeddt if fixeddt is not None else substep)
+
+    # Compass arrow sprites are part of the GUI, the model has only arrays
+    if gui is not None:
+        gui.setarrows(m,n,view)
 
-    # factor for speed of control by keys and mouse
-    adjustfactor =  np.sqrt(2) # Doubling in 2 seconds. factor per second, >1 for logical behaviour
-    
     # Set up timer for loop
     print("Starting simulation")
     tstart = clock()
     t0 = tstart
     tsim = 0     # simulated time for harmonic oscillation of B1
     maxdt = 0.1 # time step max so slow PCs won't have big time steps
+    # At the idle frame rate frames are longer, the simulation keeps up
+    # with the wall clock, substeps keep the physics steps small
+    if gui is not None and gui.idlefps > 0:
+        maxdt = max(maxdt, 1./gui.idlefps)
     running = True
 
     # Create a plotter
     dtplot = 0.1 #delta time for tables with plot data
-    plotter = Plotter(tsim,dtplot)
+    if plotcapacity is None and recorddir is not None:
+        plotcapacity = 10000 # the last 1000 s, all of it is on disk
+    plotter = Plotter(tsim,dtplot,plotcapacity)
+    if recorddir is not None:
+        plotter.startrecording(recorddir)
+    if liveplot:
+        plotter.startliveplot()
+
+    # Optional frame profiler, None when off so it costs nothing
+    if profile or tracefile is not None:
+        profiler = Profiler()
+    else:
+        profiler = None
+
+    # Physics on a worker thread, then this loop is not used
+    if threaded:
+        if not render or recordfile is not None or replayfile is not None:
+            raise ValueError("Threaded physics needs rendering, no record or replay")
+        if fixeddt is None:
+            fixeddt = 0.01
+        t = runthreaded(gui, model, plotter, fixeddt, tmax, profiler, profile)
+        running = False
 
     # Main simulation loop
     while running:
+        # Real time: wait for the next frame instead of looping with dt = 0
+        if gui is not None and fixeddt is None and replayfile is None:
+            gui.tick()
+
         # Time control in loop
         t = clock()
-        dt = min(t-t0,maxdt) # set maximum limit to dt
+        if replayfile is not None:
+            dt, nsteps, replaykeys = frames[iframe] # as recorded
+            iframe += 1
+        elif fixeddt is None:
+            framedt = min(t-t0,maxdt) # set maximum limit to dt
+            nsteps = max(1,int(np.ceil(framedt/substep))) # physics substeps
+            dt = framedt/nsteps
+        else:
+            dt = fixeddt # fixed steps, independent of wall clock
+            nsteps = renderevery
         t0 = t
+        if profiler is not None:
+            profiler.startframe()
 
-        # Plot data to be added
-        plotter.tableupdate(tsim, model.b0on*model.b0mag,
-                            model.theta, model.b1on*model.b1freq)
+        # Physics steps for this frame
+        for k in range(nsteps):
+            # Plot data to be added
+            plotter.tableupdate(tsim, model.b0on*model.b0mag,
+                                model.theta, model.b1on*model.b1freq,
+                                model.b1mag, model.b0on, model.b1on)
+            if profiler is not None:
+                profiler.mark("tableupdate")
 
-        # Simulated time, also protected for time steps larger than maxdt
-        tsim = tsim + dt
-        
-        # If a real timestep has been made, we calculate and draw
-        if dt>0:
+            # Simulated time, also protected for time steps larger than maxdt
+            tsim = tsim + dt
 
-            # Update compass arrows model
-            model.update(tsim,dt)
+            # If a real timestep has been made, we calculate
+            if dt>0:
+                # Update compass arrows model
+                model.update(tsim,dt)
+            if profiler is not None:
+                profiler.mark("model.update")
 
-            # Update GUI
+        # Simulated time of this frame, for the key controls
+        stepdt = dt
+        dt = nsteps*dt
+
+        # Update GUI, if a real timestep has been made
+        if gui is not None and dt>0:
             gui.clearscreen()
+            if profiler is not None:
+                profiler.mark("clearscreen")
             gui.textpanel(model.b0mag, model.b1mag, model.b1freq, model.b0on, model.b1on)
-            gui.drawarrows(model.arrowlist,m,n)
+            if profiler is not None:
+                profiler.mark("textpanel")
+            gui.drawarrows(model.theta)
+            if profiler is not None:
+                profiler.mark("drawarrows")
+                # HUD with the times of the previous frames
+                if profile:
+                    gui.drawhud(profiler.hudlines())
+                profiler.mark("hud")
             gui.updatescreen()
+            if profiler is not None:
+                profiler.mark("updatescreen")
     
         # Key inputs
         # B_0 magnitude with right/left
-        keyspressed = gui.getkeys()
+        if replayfile is not None:
+            # Recorded keys, Esc still stops a replay on the screen
+            keyspressed = replaykeys
+            if gui is not None and "ESC" in gui.getkeys():
+                running = False
+        elif gui is not None:
+            keyspressed = gui.getkeys()
+        else:
+            keyspressed = []
+        if sessionlog is not None:
+            sessionlog.add(stepdt, nsteps, keyspressed)
+        if profiler is not None:
+            profiler.mark("getkeys")
+
+        applykeys(model, plotter, keyspressed, dt, tsim, t)
 
-        if 'RIGHT' in keyspressed:
-            model.b0mag *= adjustfactor**dt
-        if 'LEFT' in keyspressed:
-            model.b0mag /= adjustfactor**dt
-        
-        # B_1 magnitude with up/down
-        if 'UP' in keyspressed:
-            model.b1mag *= adjustfactor**dt
-        if 'DOWN' in keyspressed:
-            model.b1mag /= adjustfactor**dt
-
-        # Frequency (B_1) with +/-
-        if 'PLUS' in keyspressed:
-            model.b1freq *= adjustfactor**(dt*0.7)
-        if 'MINUS' in keyspressed:
-            model.b1freq /= adjustfactor**(dt*0.7)
-
-        # B_0 on/off switch
-        if "B0" in keyspressed:
-            model.b0on = not model.b0on
-
-        # B_1 on/off switch
-        if "B1" in keyspressed:
-            model.b1on = not model.b1on
-
-        # Angular velocity reset
-        if "V" in keyspressed:
-                model.v = model.v * 0#
-
-        # Total reset: angular velocity & position
-        if "RESET" in keyspressed:
-            model.v = model.v*0
-            model.theta = 140+0*model.theta
-            plotter.tabletreset(tsim) # Keep track of reset times for plots
-
-        # Magnetic fields details
-        # Debug messages
-        if "B" in keyspressed and t%.2>.18:
-            #time requirement so the message isn't printed too often
-            print("____________________\n",
-                "B0 magnitude | ", round(b0mag,5), "\n",
-                "B1 magnitude | ", round(b1mag,5), "\n",
-                "B1 frequency | ", round(b1freq,5),
-                "\n____________________")
-        
         # Quit with Esc
         if "ESC" in keyspressed:
             running = False
         
-        # Runtime limit
-        if t>300:
+        # Runtime limit, simulated time when using fixed time steps
+        # and the end of the log when replaying
+        if replayfile is not None:
+            if iframe == len(frames):
+                running = False
+        elif fixeddt is None and t>tmax:
             running = False
+        elif fixeddt is not None and tsim>=tmax:
+            running = False
+
+        if profiler is not None:
+            profiler.endframe()
 
     # Exit when loop is ended
     # close screen
     print("Simulation ran",t-tstart,"seconds")
     del gui
 
+    # Save the session log, or check the replay against it
+    if sessionlog is not None:
+        sessionlog.save(recordfile, model.theta)
+    if replayfile is not None:
+        if iframe == len(frames) and np.array_equal(model.theta, thetaend):
+            print("Replay identical to the recorded session")
+        else:
+            print("Replay differs from the recorded session")
+
+    # Where the frame time went
+    if profiler is not None:
+        profiler.summary()
+        if tracefile is not None:
+            profiler.writetrace(tracefile)
+
 
     # Plot store tables with data
+    plotter.stoprecording()
+    plotter.stopliveplot()
     plotter.plotdata()
     print("Ready.")
 
+def runthreaded(gui, model, plotter, dt, tmax, profiler, profile):
+    '''
+    Loop of the main thread while the physics runs on a Physicsthread:
+    draws every new snapshot and passes the keys to the physics.
+    Returns the wall clock time at the end.
+    '''
+    physics = Physicsthread(model, plotter, dt, applykeys)
+    physics.start()
+
+    t0 = clock()
+    maxdt = 0.1
+    if gui.idlefps > 0:
+        maxdt = max(maxdt, 1./gui.idlefps) # idle frames are longer
+    drawn = -1
+    running = True
+    while running and physics.running:
+        # Draw at the frame rate, the physics has its own rate
+        gui.tick()
+
+        t = clock()
+        framedt = min(t-t0,maxdt)
+        t0 = t
+        if profiler is not None:
+            profiler.startframe()
+
+        # Draw the latest snapshot, if there is a new one
+        with physics.lock:
+            snapshot = physics.latest()
+            newframe = snapshot.count != drawn
+            if newframe:
+                drawn = snapshot.count
+                gui.clearscreen()
+                if profiler is not None:
+                    profiler.mark("clearscreen")
+                gui.textpanel(snapshot.b0mag, snapshot.b1mag, snapshot.b1freq,
+                              snapshot.b0on, snapshot.b1on)
+                if profiler is not None:
+                    profiler.mark("textpanel")
+                gui.drawarrows(snapshot.theta)
+                if profiler is not None:
+                    profiler.mark("drawarrows")
+        if newframe:
+            if profiler is not None:
+                if profile:
+                    gui.drawhud(profiler.hudlines())
+                profiler.mark("hud")
+            gui.updatescreen()
+            if profiler is not None:
+                profiler.mark("updatescreen")
+
+        # Keys go to the physics thread
+        keyspressed = gui.getkeys()
+        if len(keyspressed) > 0:
+            physics.send(keyspressed, framedt, t)
+        if profiler is not None:
+            profiler.mark("getkeys")
+
+        # Quit with Esc or at the runtime limit
+        if "ESC" in keyspressed or t>tmax:
+            running = False
+
+        if profiler is not None:
+            profiler.endframe()
+
+    physics.stop()
+    return t
+
 # "If this program is run, run main."
 # Checking this makes it easier to keep this .py file in folders for importing
 if __name__ == "__main__":
@@ -1,22 +1,28 @@
+import os
+import sys
 import pygame
 
 """
 360 rotating images maker
+Builds the atlas with all rotations of bitmaps/arrow.png in this folder.
+The simulation also does this by itself when the atlas is missing or the
+arrow image has changed.
 """
 
+# Run from the main folder, where graphics.py and bitmaps are
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.getcwd())
+from graphics import loadrotations
 
 #setup screen
 surface = pygame.display.set_mode( (512,512) )
 
+# Remove the atlas, so it is always made again
+for fname in os.listdir("sprites"):
+    if fname.startswith("arrowatlas-"):
+        os.remove(os.path.join("sprites", fname))
 
-img_source = pygame.image.load('arrow.png')
-img = img_source.copy()
-
-
-
-for i in range(360):
-    img = pygame.transform.rotate(img_source, i).convert_alpha()
-    pygame.image.save(img, "arrow"+str(i)+".png")
+loadrotations(os.path.join("bitmaps", "arrow.png"))
 
 
 pygame.quit()
@@ -0,0 +1,138 @@
+"""
+Parameter sweep for finding the resonance frequency without a GUI.
+Spreads all combinations of B0, B1, B1 frequency and tissue over a process
+pool, each worker steps a headless batch Model for a fixed simulated time.
+
+Example, scan 1000 frequencies for two B0 values:
+    python sweep.py --b0 4000 8000 --f1 0.1:5:1000 --duration 60
+"""
+import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from model import Model, combinations
+from tissue import loadtissue
+
+# Columns of the results table
+header = ["b0", "b1", "f1", "tissue", "theta", "thetadev", "tflip"]
+
+
+def runbatch(b0s, b1s, f1s, tissues, m, n, duration, dt, seed, integrator="euler",
+             kcoupling=0., sequence=None):
+    '''
+    Worker function: runs one batch of experiments for the simulated duration.
+    Returns per experiment the final (circular mean) theta, the standard
+    deviation of theta (as Plotter.devtab) and the time to flip, the first
+    time the arrows on average turned more than 90 degrees from the start.
+    '''
+    # Each batch its own seed for the noise, so a sweep is reproducible
+    model = Model(b0s, b1s, f1s, m, n, tissues, seed, integrator, kcoupling)
+    if sequence is not None:
+        model.setsequence(sequence, dt)
+
+    # NaN for experiments that never flip
+    tflip = np.full(model.batch, np.nan)
+    cosstart = np.mean(np.cos(np.radians(model.theta)), axis=(1, 2))
+
+    tsim = 0.
+    nsteps = int(round(duration / dt))
+    for k in range(nsteps):
+        tsim = tsim + dt
+        model.update(tsim, dt)
+
+        # Flipped when the mean cosine of theta changed sign since the start
+        meancos = np.mean(np.cos(np.radians(model.theta)), axis=(1, 2))
+        flipped = np.isnan(tflip) & (meancos * cosstart < 0)
+        tflip[flipped] = tsim
+
+    # Final state per experiment
+    thetarad = np.radians(model.theta.reshape(model.batch, m * n))
+    thetaend = np.degrees(np.arctan2(np.mean(np.sin(thetarad), axis=1),
+                                     np.mean(np.cos(thetarad), axis=1))) % 360
+    thetadev = np.std(model.theta.reshape(model.batch, m * n), axis=1)
+
+    return thetaend, thetadev, tflip
+
+
+def sweep(b0list, b1list, f1list, tissuelist=("",), m=5, n=4,
+          duration=30., dt=0.01, batchsize=64, workers=None, seed=0,
+          integrator="euler", kcoupling=0., sequence=None):
+    '''
+    Runs all combinations of the settings, batchsize experiments per task,
+    on a pool of worker processes (default: all cores).
+    With a pulse sequence (see sequence.py) every experiment runs it,
+    amplitudes or frequencies the sequence leaves free are the settings.
+    Returns the results table as a list of rows, see header for the columns.
+    '''
+    b0s, b1s, f1s, tissues = combinations(b0list, b1list, f1list, tissuelist)
+
+    # Read every tissue file once here, so the workers find it cached
+    for tissue in set([tissue for tissue in tissuelist if isinstance(tissue, str)]):
+        if tissue != "":
+            loadtissue(tissue, m, n)
+
+    # Split the combinations in batches for the workers
+    starts = range(0, len(b0s), batchsize)
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = []
+        for k, i in enumerate(starts):
+            j = i + batchsize
+            jobs.append(pool.submit(runbatch, b0s[i:j], b1s[i:j], f1s[i:j],
+                                    tissues[i:j], m, n, duration, dt, seed + k,
+                                    integrator, kcoupling, sequence))
+
+        # Collect in submission order, so rows match the combinations
+        for i, job in zip(starts, jobs):
+            thetaend, thetadev, tflip = job.result()
+            for k in range(len(thetaend)):
+                rows.append([b0s[i + k], b1s[i + k], f1s[i + k], tissues[i + k],
+                             thetaend[k], thetadev[k], tflip[k]])
+    return rows
+
+
+def writetable(filename, rows):
+    '''Saves the results table as a CSV file with a header line.'''
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def parserange(values):
+    '''
+    Command line values: plain numbers, or start:stop:num for a linspace.
+    '''
+    numbers = []
+    for value in values:
+        if ":" in value:
+            start, stop, num = value.split(":")
+            numbers.extend(np.linspace(float(start), float(stop), int(num)))
+        else:
+            numbers.append(float(value))
+    return numbers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless MRI 2D parameter sweep")
+    parser.add_argument("--b0", nargs="+", default=["4000"], help="B0 magnitudes")
+    parser.add_argument("--b1", nargs="+", default=["1000"], help="B1 magnitudes")
+    parser.add_argument("--f1", nargs="+", default=["0.1:5:50"], help="B1 frequencies [Hz]")
+    parser.add_argument("--tissue", nargs="+", default=[""], help="tissue files in data")
+    parser.add_argument("--size", nargs=2, type=int, default=[5, 4], help="grid m n")
+    parser.add_argument("--duration", type=float, default=30., help="simulated time [s]")
+    parser.add_argument("--dt", type=float, default=0.01, help="time step [s]")
+    parser.add_argument("--batch", type=int, default=64, help="experiments per task")
+    parser.add_argument("--workers", type=int, default=None, help="processes, default all cores")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the noise")
+    parser.add_argument("--integrator", default="euler", help="euler, verlet, rk4 or rk45")
+    parser.add_argument("--kcoupling", type=float, default=0., help="arrow coupling, 0 is off")
+    parser.add_argument("--out", default="sweep.csv", help="results CSV file")
+    args = parser.parse_args()
+
+    rows = sweep(parserange(args.b0), parserange(args.b1), parserange(args.f1),
+                 args.tissue, args.size[0], args.size[1], args.duration,
+                 args.dt, args.batch, args.workers, args.seed, args.integrator,
+                 args.kcoupling)
+    writetable(args.out, rows)
+    print("Saved", len(rows), "results in", args.out)
@@ -0,0 +1,144 @@
+"""
+Loading of tissue masks: the factor per compass arrow used to simulate
+different tissues. Text files (.tis/.csv, comma separated, # for comments)
+are parsed once and then cached as binary .npy files in data/cache, keyed
+on the file's modification time and size. Binary .npy masks are memory
+mapped, so large masks are not read into memory at once.
+Grayscale images (and raw arrays) are resampled to the grid by area
+averaging, the image brightness (0-1) is the tissue factor. The resampled
+mask is cached per image file and grid size.
+"""
+import os
+import numpy as np
+
+# Folders with tissue files and with the cached binary versions
+datadir = "data"
+cachedir = os.path.join("data", "cache")
+
+# Extensions of tissue files read as image
+imageexts = (".png", ".jpg", ".jpeg", ".bmp", ".gif")
+
+
+def tissuefilename(tissuefile):
+    '''
+    Path of a tissue file in the data folder.
+    No .tis, .csv, .npy or image extension means ".tis" is added.
+    '''
+    filename = os.path.join(datadir, tissuefile)
+    if os.path.splitext(filename)[1].lower() not in (".tis", ".csv", ".npy") + imageexts:
+        filename += ".tis"
+    return filename
+
+
+def loadtissue(tissuefile, m, n):
+    '''
+    Returns the (m, n) tissue mask of a tissue file in the data folder,
+    or of a raw 2D array (x, y) which is resampled to the grid.
+    Rows in a text file or image are y, columns x, so the data is transposed.
+    Raises a ValueError when the mask does not fit the m x n grid.
+    '''
+    # Raw array, resample to the grid
+    if isinstance(tissuefile, np.ndarray):
+        return resample(tissuefile, m, n)
+
+    filename = tissuefilename(tissuefile)
+
+    if filename.endswith(".npy"):
+        # Binary mask, already (m, n)
+        mask = np.load(filename, mmap_mode="r")
+    elif os.path.splitext(filename)[1].lower() in imageexts:
+        # Image resampled to this grid size, cached per size
+        cachefile = cachename(filename, "-" + str(m) + "x" + str(n))
+        if os.path.exists(cachefile):
+            mask = np.load(cachefile, mmap_mode="r")
+        else:
+            print("Reading " + filename)
+            mask = resample(readimage(filename), m, n)
+            savecache(filename, cachefile, mask)
+    else:
+        # Cached binary version of this file, made if not there
+        cachefile = cachename(filename)
+        if os.path.exists(cachefile):
+            mask = np.load(cachefile, mmap_mode="r")
+        else:
+            print("Reading " + filename)
+            mask = np.loadtxt(filename, delimiter=",", comments="#", ndmin=2).T
+            savecache(filename, cachefile, mask)
+
+    if mask.shape != (m, n):
+        raise ValueError("Tissue file " + filename + " has shape " + str(mask.shape) +
+                         ", grid is " + str((m, n)))
+    return mask
+
+
+def readimage(filename):
+    '''
+    Reads an image as grayscale brightness 0-1, transposed to (x, y).
+    Colour images are averaged over red, green and blue.
+    '''
+    # Only needed for images, so imported here
+    import matplotlib.image as mpimg
+
+    img = mpimg.imread(filename)
+    if img.dtype == np.uint8:
+        img = img / 255.
+    if img.ndim == 3:
+        img = img[:, :, :3].mean(axis=2)
+    return img.T
+
+
+def resample(image, m, n):
+    '''
+    Resamples a 2D array (x, y) to (m, n) by area averaging: every grid cell
+    gets the mean of the image area it covers, with pixels partly inside a
+    cell counting for that part. Done with two matrix products.
+    '''
+    image = np.asarray(image, dtype=float)
+    return overlap(image.shape[0], m) @ image @ overlap(image.shape[1], n).T
+
+
+def overlap(size, cells):
+    '''
+    Matrix (cells, size) with the fraction of every pixel that lies in each
+    cell, when size pixels are divided over cells, rows normalized to 1.
+    '''
+    # Pixel and cell edges, both in pixel units
+    pixedges = np.arange(size + 1)
+    celledges = np.linspace(0, size, cells + 1)
+    lo = np.maximum(celledges[:-1, None], pixedges[None, :-1])
+    hi = np.minimum(celledges[1:, None], pixedges[None, 1:])
+    weights = np.maximum(hi - lo, 0)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def cachename(filename, suffix=""):
+    '''Name of the cache file for this version of the file.'''
+    stat = os.stat(filename)
+    return os.path.join(cachedir, os.path.basename(filename) + "-" + str(stat.st_mtime_ns) +
+                        "-" + str(stat.st_size) + suffix + ".npy")
+
+
+def savecache(filename, cachefile, mask):
+    '''
+    Saves the mask as cache file, removing caches of older versions of the file.
+    Other processes (sweep workers) may read the cache at the same time, so
+    it is written to a temporary file first and then renamed, and caches
+    already removed by another process are skipped.
+    '''
+    os.makedirs(cachedir, exist_ok=True)
+    prefix = os.path.basename(filename) + "-"
+    current = os.path.basename(cachename(filename))[:-len(".npy")]
+    for oldname in os.listdir(cachedir):
+        if oldname.startswith(prefix) and not (oldname.startswith(current + "-") or
+                                               oldname.startswith(current + ".npy")):
+            try:
+                os.remove(os.path.join(cachedir, oldname))
+            except FileNotFoundError:
+                pass
+
+    # Temporary file of this process, so a cache file is always complete
+    tmpname = cachefile + "." + str(os.getpid()) + ".tmp"
+    f = open(tmpname, "wb")
+    np.save(f, mask)
+    f.close()
+    os.replace(tmpname, cachefile)